@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.urls import URLPattern
+from rest_framework.permissions import SAFE_METHODS
+
+# Маршруты роутера, у которых есть асинхронный вариант.
+ASYNC_ROUTES = (
+    'tags-list', 'tags-detail',
+    'ingredients-list', 'ingredients-detail',
+    'recipes-detail', 'recipes-download-shopping-cart',
+)
+
+
+@lru_cache(maxsize=1)
+def get_executor():
+    return ThreadPoolExecutor(
+        max_workers=settings.ASYNC_READ_WORKERS,
+        thread_name_prefix='async-read',
+    )
+
+
+def materialize(response):
+    """Потоковый ответ целиком в памяти.
+
+    Django 3.2 под ASGI перебирает потоковый ответ в цикле событий, где
+    обращаться к базе нельзя, поэтому файл собирается ещё в пуле.
+    """
+    materialized = HttpResponse(
+        b''.join(response.streaming_content), status=response.status_code
+    )
+    for header, value in response.items():
+        materialized[header] = value
+    return materialized
+
+
+def run_view(view, request, *args, **kwargs):
+    """Выполняет синхронную вьюху в потоке пула до готового ответа.
+
+    Подключения к базам у потоков пула свои, сигналы запроса их не
+    закрывают, поэтому это делается здесь.
+    """
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        if response.streaming:
+            response = materialize(response)
+    finally:
+        close_old_connections()
+    return response
+
+
+def async_variant(view):
+    """Асинхронный вариант вьюхи для ASGI.
+
+    Безопасные запросы работают с ORM в пуле из ASYNC_READ_WORKERS
+    потоков, а медленные клиенты ждут ответа в цикле событий, не занимая
+    поток. Изменяющие запросы того же маршрута выполняются, как обычная
+    синхронная вьюха под ASGI: в потоке Django для синхронного кода.
+    """
+    run = sync_to_async(
+        run_view, thread_sensitive=False, executor=get_executor()
+    )
+    write = sync_to_async(view, thread_sensitive=True)
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return await write(request, *args, **kwargs)
+        return await run(view, request, *args, **kwargs)
+
+    return async_view
+
+
+def async_patterns(patterns):
+    """Маршруты, в которых вьюхи из ASYNC_ROUTES заменены асинхронными."""
+    return [
+        URLPattern(
+            pattern.pattern,
+            async_variant(pattern.callback),
+            pattern.default_args,
+            pattern.name,
+        ) if pattern.name in ASYNC_ROUTES else pattern
+        for pattern in patterns
+    ]
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+User = get_user_model()
+
+# Метка сброшенной записи: пока она в кэше, токен проверяется по базе.
+FORGOTTEN = 'forgotten'
+
+
+def token_cache_key(key):
+    return f'token:{key}'
+
+
+def forget_tokens(keys):
+    """Сбрасывает записи токенов в кэше после удаления токена.
+
+    Вместо удаления записи ставится метка: запрос, который прочитал
+    токен из базы до удаления, не сможет положить в кэш старые данные.
+    """
+    caches[settings.TOKEN_CACHE].set_many(
+        {token_cache_key(key): FORGOTTEN for key in keys},
+        settings.TOKEN_CACHE_TIMEOUT,
+    )
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который берёт id пользователя токена из кэша.
+
+    Сам пользователь читается из базы по первичному ключу: объект из
+    кэша был бы устаревшим, а его сохранение затёрло бы новые данные.
+    Записи сбрасываются сигналом удаления токена, поэтому кэш должен
+    быть общим для всех процессов.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = caches[settings.TOKEN_CACHE]
+        cache_key = token_cache_key(key)
+        cached = cache.get(cache_key)
+        if cached is None or cached == FORGOTTEN:
+            user, token = super().authenticate_credentials(key)
+            if cached is None:
+                cache.add(cache_key, user.pk, settings.TOKEN_CACHE_TIMEOUT)
+            return user, token
+        user = User.objects.filter(pk=cached).first()
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        return user, self.get_model()(key=key, user=user)
@@ -0,0 +1,458 @@
+import asyncio
+import base64
+import io
+import math
+import time
+import tracemalloc
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, resolve
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import urls
+from .exports import EXPORT_FORMATS
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            ShoppingCart, Tag)
+from users.models import Follow, User
+
+API_PREFIX = 'api/'
+# Разница меньше этой считается шумом даже у самых быстрых эндпоинтов.
+NOISE_MS = 1.0
+
+
+def api_routes(patterns=None, prefix=''):
+    """Все маршруты api/urls.py, кроме суффиксов формата и корня роутера.
+
+    Маршруты склеиваются, как в ResolverMatch.route: без «^».
+    """
+    if patterns is None:
+        patterns = urls.urlpatterns
+    routes = []
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern).lstrip('^')
+        if isinstance(pattern, URLResolver):
+            routes.extend(api_routes(pattern.url_patterns, route))
+        elif isinstance(pattern, URLPattern):
+            if '(?P<format>' not in route and route != '$':
+                routes.append(route)
+    return routes
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(share * len(ordered)) - 1, 0)]
+
+
+def token_client(token):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+    return client
+
+
+def png_data_url():
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), (73, 182, 78)).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+class BenchmarkContext:
+    """Пользователь, от имени которого идут запросы, и данные для них.
+
+    Для изменяющих запросов выбираются рецепт и автор, которых у
+    пользователя ещё нет в избранном, списке покупок и подписках, —
+    каждый сценарий возвращает данные в исходное состояние.
+    """
+
+    def __init__(self, user, password):
+        self.user = user
+        self.password = password
+        self.anonymous = APIClient()
+        self.client = token_client(
+            Token.objects.get_or_create(user=user)[0].key
+        )
+        self.recipe = Recipe.objects.exclude(author=user).exclude(
+            id__in=FavoriteRecipe.objects.filter(user=user).values('recipe')
+        ).exclude(
+            id__in=ShoppingCart.objects.filter(user=user).values('recipe')
+        ).order_by('-pub_date').first()
+        self.author = User.objects.exclude(id=user.id).exclude(
+            id__in=Follow.objects.filter(user=user).values('author')
+        ).order_by('-recipes_count').first()
+        self.tags = list(Tag.objects.order_by('id').values_list(
+            'id', 'slug'
+        )[:2])
+        self.ingredient = Ingredient.objects.order_by('id').first()
+        self.image = png_data_url()
+        self.signups = 0
+
+    @classmethod
+    def for_busiest_user(cls, password, email_domain=None):
+        users = User.objects.annotate(
+            follows=Count('follower')
+        ).order_by('-follows', 'id')
+        if email_domain is not None:
+            users = users.filter(email__endswith=f'@{email_domain}')
+        user = users.first()
+        if user is None or not Recipe.objects.exists():
+            return None
+        return cls(user, password)
+
+    def recipe_payload(self, name):
+        return {
+            'name': name,
+            'text': 'Рецепт для бенчмарка',
+            'cooking_time': 10,
+            'image': self.image,
+            'tags': [tag_id for tag_id, _ in self.tags],
+            'ingredients': [{'id': self.ingredient.id, 'amount': 100}],
+        }
+
+
+def step(label, client, method, path, **kwargs):
+    """Один замеряемый запрос сценария."""
+    return label, client, method, path, kwargs
+
+
+def read_recipes(context):
+    slugs = '&'.join(f'tags={slug}' for _, slug in context.tags)
+    yield step(
+        'recipes: список, аноним', context.anonymous, 'get', '/api/recipes/'
+    )
+    yield step('recipes: список', context.client, 'get', '/api/recipes/')
+    yield step(
+        'recipes: фильтры', context.client, 'get',
+        f'/api/recipes/?{slugs}&is_favorited=1&limit=20'
+    )
+    yield step(
+        'recipes: поиск', context.client, 'get',
+        f'/api/recipes/?search={context.recipe.name}'
+    )
+    yield step(
+        'recipes: курсор', context.client, 'get', '/api/recipes/?cursor='
+    )
+    yield step(
+        'recipes: рецепт', context.client, 'get',
+        f'/api/recipes/{context.recipe.id}/'
+    )
+    yield step('recipes: лента', context.client, 'get', '/api/recipes/feed/')
+
+
+def write_recipe(context):
+    response = yield step(
+        'recipes: создание', context.client, 'post', '/api/recipes/',
+        data=context.recipe_payload('Бенчмарк'), format='json'
+    )
+    path = f'/api/recipes/{response.json()["id"]}/'
+    yield step(
+        'recipes: изменение', context.client, 'patch', path,
+        data=context.recipe_payload('Бенчмарк 2'), format='json'
+    )
+    yield step('recipes: удаление', context.client, 'delete', path)
+
+
+def recipe_lists(context):
+    for action in ('favorite', 'shopping_cart'):
+        path = f'/api/recipes/{context.recipe.id}/{action}/'
+        yield step(f'{action}: добавление', context.client, 'post', path)
+        yield step(f'{action}: удаление', context.client, 'delete', path)
+        path = f'/api/recipes/{action}/'
+        data = {'recipes': [context.recipe.id]}
+        yield step(
+            f'{action}: массовое добавление', context.client, 'post', path,
+            data=data, format='json'
+        )
+        yield step(
+            f'{action}: массовое удаление', context.client, 'delete', path,
+            data=data, format='json'
+        )
+    yield step(
+        'shopping_cart: итоги', context.client, 'get',
+        '/api/recipes/shopping_cart/summary/'
+    )
+    for export_format in EXPORT_FORMATS:
+        yield step(
+            f'download_shopping_cart: {export_format}', context.client,
+            'get',
+            f'/api/recipes/download_shopping_cart/?format={export_format}'
+        )
+
+
+def catalog(context):
+    tag_id = context.tags[0][0]
+    prefix = context.ingredient.name[:3]
+    yield step('tags: список', context.anonymous, 'get', '/api/tags/')
+    yield step('tags: тэг', context.anonymous, 'get', f'/api/tags/{tag_id}/')
+    yield step(
+        'ingredients: поиск', context.anonymous, 'get',
+        f'/api/ingredients/?name={prefix}'
+    )
+    yield step(
+        'ingredients: ингредиент', context.anonymous, 'get',
+        f'/api/ingredients/{context.ingredient.id}/'
+    )
+
+
+def subscriptions(context):
+    path = f'/api/users/{context.author.id}/subscribe/'
+    yield step(
+        'subscriptions: список', context.client, 'get',
+        '/api/users/subscriptions/'
+    )
+    yield step('subscribe: подписка', context.client, 'post', path)
+    yield step('subscribe: отписка', context.client, 'delete', path)
+    data = {'authors': [context.author.id]}
+    yield step(
+        'subscribe: массовая подписка', context.client, 'post',
+        '/api/users/subscribe/', data=data, format='json'
+    )
+    yield step(
+        'subscribe: массовая отписка', context.client, 'delete',
+        '/api/users/subscribe/', data=data, format='json'
+    )
+
+
+def accounts(context):
+    """Профили, смена пароля и полный цикл нового пользователя.
+
+    Вход и выход делает только новый пользователь: djoser выдаёт
+    существующий токен, и выход основного пользователя сломал бы
+    остальные сценарии.
+    """
+    yield step('users: список', context.anonymous, 'get', '/api/users/')
+    yield step(
+        'users: профиль', context.client, 'get',
+        f'/api/users/{context.author.id}/'
+    )
+    yield step('users: me', context.client, 'get', '/api/users/me/')
+    yield step(
+        'users: смена пароля', context.client, 'post',
+        '/api/users/set_password/', data={
+            'current_password': context.password,
+            'new_password': context.password,
+        }
+    )
+    context.signups += 1
+    email = f'signup{context.signups}-{time.time_ns()}@benchmark.local'
+    password = 'Benchmark-signup-1'
+    yield step(
+        'users: регистрация', context.anonymous, 'post', '/api/users/',
+        data={
+            'email': email, 'username': email.split('@')[0],
+            'first_name': 'Бенчмарк', 'last_name': 'Регистрация',
+            'password': password,
+        }
+    )
+    login = {'email': email, 'password': password}
+    response = yield step(
+        'auth: вход', context.anonymous, 'post', '/api/auth/token/login/',
+        data=login
+    )
+    yield step(
+        'auth: выход', token_client(response.json()['auth_token']), 'post',
+        '/api/auth/token/logout/'
+    )
+    response = yield step(
+        'auth: вход', context.anonymous, 'post', '/api/auth/token/login/',
+        data=login
+    )
+    yield step(
+        'users: удаление', token_client(response.json()['auth_token']),
+        'delete', '/api/users/me/', data={'current_password': password}
+    )
+
+
+SCENARIOS = (
+    read_recipes, write_recipe, recipe_lists, catalog, subscriptions,
+    accounts,
+)
+
+
+def send(step):
+    """Выполняет запрос и читает ответ целиком, включая потоковый."""
+    _, client, method, path, kwargs = step
+    response = getattr(client, method)(path, **kwargs)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def run_scenarios(context, measure):
+    """Прогоняет все сценарии, передавая каждый запрос в measure."""
+    for scenario in SCENARIOS:
+        steps = scenario(context)
+        response = None
+        while True:
+            try:
+                step = steps.send(response)
+            except StopIteration:
+                break
+            response = measure(step)
+
+
+class BenchmarkRunner:
+    """Замеры времени, числа запросов к базе и пиковой памяти.
+
+    Время меряется в отдельных прогонах, без tracemalloc и перехвата
+    SQL, которые сами замедляют запросы.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.timings = defaultdict(list)
+        self.profile = {}
+        self.routes = set()
+
+    def timed(self, step):
+        started = time.perf_counter()
+        try:
+            return send(step)
+        finally:
+            self.timings[step[0]].append(
+                (time.perf_counter() - started) * 1000
+            )
+
+    def profiled(self, step):
+        with CaptureQueriesContext(connection) as queries:
+            tracemalloc.start()
+            try:
+                response = send(step)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        self.profile[step[0]] = {
+            'status': response.status_code,
+            'queries': len(queries.captured_queries),
+            'peak_kib': round(peak / 1024, 1),
+        }
+        self.routes.add(resolve(step[3].split('?')[0]).route)
+        return response
+
+    def run(self, iterations, warmup):
+        for _ in range(warmup):
+            run_scenarios(self.context, send)
+        for _ in range(iterations):
+            run_scenarios(self.context, self.timed)
+        run_scenarios(self.context, self.profiled)
+        return {
+            label: {
+                'p50_ms': round(percentile(values, 0.5), 2),
+                'p95_ms': round(percentile(values, 0.95), 2),
+                **self.profile[label],
+            }
+            for label, values in self.timings.items()
+        }
+
+    def uncovered_routes(self):
+        covered = {route[len(API_PREFIX):] for route in self.routes}
+        return [route for route in api_routes() if route not in covered]
+
+
+def compare(results, baseline, threshold):
+    """Ухудшения относительно baseline: рост p95 больше threshold или
+    рост числа запросов к базе.
+    """
+    regressions = []
+    for label, result in results.items():
+        base = baseline.get(label)
+        if base is None:
+            continue
+        allowed = max(base['p95_ms'] * threshold, NOISE_MS)
+        if result['p95_ms'] > base['p95_ms'] + allowed:
+            regressions.append(
+                f'{label}: p95 {base["p95_ms"]} → {result["p95_ms"]} мс'
+            )
+        if result['queries'] > base['queries']:
+            regressions.append(
+                f'{label}: запросов {base["queries"]} → {result["queries"]}'
+            )
+    return regressions
+
+
+class SlowClients:
+    """Нагрузка медленными клиентами на запущенный сервер.
+
+    Медленный клиент присылает заголовки запроса по частям в течение
+    slow_seconds, как мобильный клиент на плохой связи. Пока clients
+    таких соединений открыты, быстрые пробные запросы меряют, успевает
+    ли сервер обслуживать остальных. Синхронный воркер занят одним
+    соединением целиком, воркер uvicorn — нет.
+    """
+
+    CHUNKS = 10
+
+    def __init__(self, host, port, path, token=None, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+        self.headers = f'Host: {host}\r\nConnection: close\r\n'
+        if token:
+            self.headers += f'Authorization: Token {token}\r\n'
+
+    async def request(self, slow_seconds=0.0):
+        """Время ответа в секундах и код ответа, None при ошибке."""
+        started = time.perf_counter()
+        writer = None
+        try:
+            reader, writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+            writer.write(
+                f'GET {self.path} HTTP/1.1\r\n{self.headers}'.encode()
+            )
+            for chunk in range(self.CHUNKS if slow_seconds else 0):
+                await writer.drain()
+                await asyncio.sleep(slow_seconds / self.CHUNKS)
+                writer.write(f'X-Slow-{chunk}: 1\r\n'.encode())
+            writer.write(b'\r\n')
+            await writer.drain()
+            status_line = await reader.readline()
+            await reader.read()
+            status = int(status_line.split()[1])
+        except (OSError, ValueError, IndexError):
+            status = None
+        finally:
+            if writer is not None:
+                writer.close()
+        return time.perf_counter() - started, status
+
+    async def timed_request(self, slow_seconds=0.0):
+        try:
+            return await asyncio.wait_for(
+                self.request(slow_seconds), self.timeout
+            )
+        except asyncio.TimeoutError:
+            return self.timeout, None
+
+    async def run(self, clients, slow_seconds, probes):
+        slow = [
+            asyncio.ensure_future(self.timed_request(slow_seconds))
+            for _ in range(clients)
+        ]
+        # Пробы идут, когда медленные клиенты уже заняли соединения.
+        await asyncio.sleep(min(slow_seconds / 2, 1.0))
+        probed = await asyncio.gather(
+            *(self.timed_request() for _ in range(probes))
+        )
+        return await asyncio.gather(*slow), probed
+
+
+def summarize(results):
+    """Сколько запросов обслужено и p50/p95 их времени."""
+    served = [elapsed for elapsed, status in results if status == 200]
+    return {
+        'served': len(served),
+        'failed': len(results) - len(served),
+        **{
+            key: round(percentile(served, share) * 1000, 1) if served
+            else None
+            for key, share in (('p50_ms', 0.5), ('p95_ms', 0.95))
+        },
+    }
@@ -0,0 +1,73 @@
+import hashlib
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from .replicas import read_alias
+from recipes.cache import get_version
+
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+CATALOG_CACHE_CONTROL = 'public, max-age=60'
+# Ответ, собранный на реплике, мог не застать смену версии, поэтому
+# хранится недолго.
+REPLICA_CACHE_TIMEOUT = 60
+
+
+class VersionedCacheMixin:
+    """Отдаёт ответы на чтение из кэша по версии справочника.
+
+    Версия меняется сигналами при изменении модели. Пока она прежняя,
+    готовое тело ответа и ETag берутся из кэша, а на If-None-Match с тем
+    же ETag отдаётся 304 без запросов к базе.
+    """
+
+    cache_version_name = None
+
+    def perform_authentication(self, request):
+        # Справочники открыты всем, пользователь определяется лениво,
+        # только если к нему обратятся.
+        pass
+
+    def cached_response(self, request, build_response):
+        # Адрес хэшируется: в ключах memcached не больше 250 символов
+        # ASCII без пробелов.
+        key = 'response:{}:{}:{}'.format(
+            self.cache_version_name,
+            get_version(self.cache_version_name),
+            hashlib.sha256(request.get_full_path().encode()).hexdigest(),
+        )
+        cached = cache.get(key)
+        if cached is None:
+            response = build_response()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            body = JSONRenderer().render(response.data)
+            cached = (f'"{hashlib.sha256(body).hexdigest()}"', body)
+            cache.set(key, cached, (
+                CATALOG_CACHE_TIMEOUT if read_alias.get() is None
+                else REPLICA_CACHE_TIMEOUT
+            ))
+        etag, body = cached
+        if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = CATALOG_CACHE_CONTROL
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(VersionedCacheMixin, self).list(
+                request, *args, **kwargs
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(VersionedCacheMixin, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
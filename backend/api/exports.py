@@ -0,0 +1,168 @@
+import csv
+import io
+from itertools import groupby
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from recipes.cache import get_version
+from recipes.models import CartIngredientTotal
+
+SHOPPING_CART_TITLE = 'Список покупок:'
+SHOPPING_CART_CACHE_TIMEOUT = 60 * 60 * 24
+PDF_FONT = 'ShoppingCartFont'
+# Единицы, которые переводятся в базовую: (базовая единица, множитель).
+UNIT_CONVERSIONS = {
+    'кг': ('г', 1000),
+    'л': ('мл', 1000),
+}
+
+
+def shopping_cart_ingredients(user):
+    """Суммарное количество ингредиентов из списка покупок.
+
+    Берётся из итогов, которые обновляются при изменении списка.
+    """
+    return CartIngredientTotal.objects.filter(user=user).values(
+        'ingredient__name', 'ingredient__measurement_unit',
+        sum_amount=F('total_amount'),
+    ).order_by('ingredient__name', 'ingredient__measurement_unit')
+
+
+def normalize_units(ingredients):
+    """Сводит в одну строку одноимённые ингредиенты в переводимых друг в
+    друга единицах, например 1 кг и 500 г муки — в 1500 г.
+    """
+    for name, group in groupby(
+        ingredients, key=lambda ingredient: ingredient['ingredient__name']
+    ):
+        amounts = {}
+        for ingredient in group:
+            unit = ingredient['ingredient__measurement_unit']
+            base, _ = UNIT_CONVERSIONS.get(unit, (unit, 1))
+            amounts.setdefault(base, {})[unit] = ingredient['sum_amount']
+        for base, units in amounts.items():
+            if len(units) == 1:
+                (unit, amount), = units.items()
+            else:
+                unit, amount = base, sum(
+                    amount * UNIT_CONVERSIONS.get(unit, (unit, 1))[1]
+                    for unit, amount in units.items()
+                )
+            yield {
+                'ingredient__name': name,
+                'ingredient__measurement_unit': unit,
+                'sum_amount': amount,
+            }
+
+
+def ingredient_line(ingredient):
+    return (
+        f'{ingredient["ingredient__name"]}'
+        f'({ingredient["ingredient__measurement_unit"]}) - '
+        f'{ingredient["sum_amount"]}'
+    )
+
+
+def render_txt(ingredients):
+    yield f'{SHOPPING_CART_TITLE}\n'
+    for ingredient in ingredients:
+        yield f'{ingredient_line(ingredient)}\n'
+
+
+class Echo:
+    """Буфер для csv.writer, который сразу возвращает записанное."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(ingredients):
+    writer = csv.writer(Echo())
+    # BOM нужен, чтобы Excel распознал кодировку.
+    yield '\ufeff'
+    yield writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['ingredient__measurement_unit'],
+            ingredient['sum_amount'],
+        ))
+
+
+def render_pdf(ingredients):
+    if PDF_FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT, settings.SHOPPING_CART_PDF_FONT)
+        )
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    top = height - 2 * cm
+    pdf.setFont(PDF_FONT, 14)
+    pdf.drawString(2 * cm, top, SHOPPING_CART_TITLE)
+    pdf.setFont(PDF_FONT, 11)
+    position = top - cm
+    for ingredient in ingredients:
+        if position < 2 * cm:
+            pdf.showPage()
+            pdf.setFont(PDF_FONT, 11)
+            position = top
+        pdf.drawString(2 * cm, position, ingredient_line(ingredient))
+        position -= 0.6 * cm
+    pdf.save()
+    yield buffer.getvalue()
+
+
+EXPORT_FORMATS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'pdf': (render_pdf, 'application/pdf'),
+}
+
+
+def cache_chunks(key, chunks):
+    """Отдаёт части файла и сохраняет файл целиком в кэш."""
+    parts = []
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        parts.append(chunk)
+        yield chunk
+    cache.set(key, b''.join(parts), SHOPPING_CART_CACHE_TIMEOUT)
+
+
+def shopping_cart_response(user, export_format):
+    """Файл со списком покупок в заданном формате.
+
+    Готовый файл кэшируется для пользователя до изменения его списка
+    покупок, рецептов в нём или справочника ингредиентов.
+    """
+    render, content_type = EXPORT_FORMATS[export_format]
+    key = 'shopping_cart:{}:{}:{}:{}'.format(
+        user.id,
+        get_version(f'shopping_cart:{user.id}'),
+        get_version('ingredients'),
+        export_format,
+    )
+    content = cache.get(key)
+    if content is None:
+        response = StreamingHttpResponse(
+            cache_chunks(key, render(normalize_units(
+                shopping_cart_ingredients(user).iterator()
+            ))),
+            content_type=content_type,
+        )
+    else:
+        response = HttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = (
+        f'attachment; filename=shopping_cart.{export_format}'
+    )
+    return response
@@ -1,6 +1,31 @@
+import base64
+import binascii
+import hashlib
+import io
+
 import webcolors
+from django.core.files.uploadedfile import SimpleUploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
 from rest_framework import serializers
 
+from recipes.images import variant_names
+
+
+def image_variants(storage, name, request=None):
+    """Ссылки на уменьшенные копии картинки по ширине.
+
+    Вызывать только для картинок с готовыми копиями: хранилище здесь не
+    проверяется, готовность записана в Recipe.variants_image.
+    """
+    variants = {}
+    for width, variant in variant_names(name).items():
+        url = storage.url(variant)
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        variants[str(width)] = url
+    return variants
+
 
 class HexToNameColor(serializers.Field):
     def to_representation(self, value):
@@ -11,3 +36,49 @@ class HexToNameColor(serializers.Field):
             return webcolors.hex_to_name(data)
         except ValueError:
             raise serializers.ValidationError('Для этого цвета нет имени')
+
+
+class HashedBase64ImageField(Base64ImageField):
+    """Картинка в base64, которая сохраняется под хэшем содержимого.
+
+    Данные декодируются и проверяются Pillow один раз.
+    """
+
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(data, str):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        if ';base64,' in data:
+            data = data.split(';base64,', 1)[1]
+        try:
+            decoded_file = base64.b64decode(data)
+            image = Image.open(io.BytesIO(decoded_file))
+            image.verify()
+        except (TypeError, ValueError, binascii.Error, OSError):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        extension = image.format.lower().replace('jpeg', 'jpg')
+        if extension not in self.ALLOWED_TYPES:
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+        return SimpleUploadedFile(
+            name=f'{hashlib.sha256(decoded_file).hexdigest()}.{extension}',
+            content=decoded_file,
+            content_type=Image.MIME.get(image.format),
+        )
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на готовые уменьшенные копии картинки по ширине."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.variants_ready:
+            return {}
+        return image_variants(
+            recipe.image.storage, recipe.image.name,
+            self.context.get('request')
+        )
@@ -1,16 +1,21 @@
 from django_filters.rest_framework import FilterSet, filters
-from rest_framework.filters import SearchFilter
 
-from recipes.models import Recipe, Tag
+from recipes.index import get_tag_bits
+from recipes.models import Recipe
+from recipes.search import search_recipes
+
+
+def tag_choices():
+    return [(slug, slug) for slug in get_tag_bits()]
 
 
 class RecipeFilter(FilterSet):
     author = filters.NumberFilter(field_name='author__id')
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='get_tags'
     )
+    search = filters.CharFilter(method='get_search')
     is_favorited = filters.BooleanFilter(method='get_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
@@ -18,22 +23,28 @@ class RecipeFilter(FilterSet):
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'search', 'is_favorited',
+                  'is_in_shopping_cart')
 
-    def get_is_favorited(self, queryset, name, value):
-        if value and self.request.user.is_authenticated:
-            return queryset.filter(
-                favorite_recipe__user=self.request.user
-            )
-        return queryset
+    def get_tags(self, queryset, name, value):
+        bits = get_tag_bits()
+        return queryset.with_any_tag(
+            sum(1 << bits[slug] for slug in set(value))
+        )
 
-    def get_is_in_shopping_cart(self, queryset, name, value):
-        if value:
-            return queryset.filter(recipe_cart__user=self.request.user)
-        return queryset
+    def get_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
 
+    def get_is_favorited(self, queryset, name, value):
+        if not value:
+            return queryset
+        if not self.request.user.is_authenticated:
+            return queryset.none()
+        return queryset.favorited_by(self.request.user)
 
-class IngredientSearchFilter(SearchFilter):
-    """Фильтр для поиска ингредиента по наименованию."""
-
-    search_param = 'name'
+    def get_is_in_shopping_cart(self, queryset, name, value):
+        if not value:
+            return queryset
+        if not self.request.user.is_authenticated:
+            return queryset.none()
+        return queryset.in_shopping_cart_of(self.request.user)
@@ -0,0 +1,77 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from api.benchmarks import BenchmarkContext, BenchmarkRunner, compare
+from recipes.management.commands.seed_benchmark_data import (
+    BENCHMARK_DOMAIN, BENCHMARK_PASSWORD)
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет все маршруты API через тестовый клиент и меряет '
+        'p50/p95, число запросов к базе и пиковую память'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument(
+            '--output', help='Куда записать результаты в JSON'
+        )
+        parser.add_argument(
+            '--baseline', help='JSON прошлого запуска для сравнения'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Допустимый рост p95 относительно baseline, доля'
+        )
+        parser.add_argument(
+            '--password', default=BENCHMARK_PASSWORD,
+            help='Пароль пользователя, от имени которого идут запросы'
+        )
+
+    def handle(self, *args, **options):
+        context = BenchmarkContext.for_busiest_user(
+            options['password'], BENCHMARK_DOMAIN
+        )
+        if context is None:
+            raise CommandError(
+                'Нет данных: сначала запустите seed_benchmark_data'
+            )
+        runner = BenchmarkRunner(context)
+        with override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']
+        ):
+            results = runner.run(options['iterations'], options['warmup'])
+        self.stdout.write(
+            f'{"эндпоинт":40} {"p50, мс":>9} {"p95, мс":>9} '
+            f'{"SQL":>5} {"память, КиБ":>12} {"код":>5}'
+        )
+        for label, result in results.items():
+            line = (
+                f'{label:40} {result["p50_ms"]:9.2f} {result["p95_ms"]:9.2f} '
+                f'{result["queries"]:5} {result["peak_kib"]:12.1f} '
+                f'{result["status"]:5}'
+            )
+            if result['status'] >= 400:
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        for route in runner.uncovered_routes():
+            self.stdout.write(self.style.WARNING(f'Не замерен: {route}'))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as baseline:
+                regressions = compare(
+                    results, json.load(baseline), options['threshold']
+                )
+            if regressions:
+                raise CommandError(
+                    'Ухудшения относительно baseline:\n'
+                    + '\n'.join(regressions)
+                )
+            self.stdout.write(self.style.SUCCESS('Ухудшений нет'))
@@ -0,0 +1,59 @@
+import asyncio
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import SlowClients, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        'Держит открытыми медленные соединения к запущенному серверу и '
+        'меряет, сколько быстрых запросов он успевает обслужить'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'url', help='Адрес эндпоинта, например http://localhost:8000'
+                        '/api/tags/'
+        )
+        parser.add_argument('--clients', type=int, default=50)
+        parser.add_argument(
+            '--slow-seconds', type=float, default=5.0,
+            help='Сколько медленный клиент присылает заголовки'
+        )
+        parser.add_argument('--probes', type=int, default=20)
+        parser.add_argument(
+            '--timeout', type=float, default=30.0,
+            help='Запрос дольше этого считается необслуженным'
+        )
+        parser.add_argument('--token', help='Токен для заголовка запросов')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('Нужен адрес вида http://хост:порт/путь')
+        path = url.path or '/'
+        if url.query:
+            path += f'?{url.query}'
+        load = SlowClients(
+            url.hostname, url.port or 80, path, options['token'],
+            options['timeout'],
+        )
+        slow, probes = asyncio.run(load.run(
+            options['clients'], options['slow_seconds'], options['probes']
+        ))
+        self.stdout.write(
+            f'{"запросы":12} {"обслужено":>10} {"ошибки":>7} '
+            f'{"p50, мс":>9} {"p95, мс":>9}'
+        )
+        for label, results in (('медленные', slow), ('пробы', probes)):
+            result = summarize(results)
+            p50, p95 = (
+                '-' if result[key] is None else result[key]
+                for key in ('p50_ms', 'p95_ms')
+            )
+            self.stdout.write(
+                f'{label:12} {result["served"]:10} {result["failed"]:7} '
+                f'{p50:>9} {p95:>9}'
+            )
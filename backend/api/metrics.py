@@ -0,0 +1,260 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.renderers import JSONRenderer
+
+METRICS_ENABLED_KEY = 'metrics:enabled'
+METRICS_PREFIX = 'foodgram'
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# Имя метрики, описание, корзины и атрибут RequestMetrics.
+HISTOGRAMS = (
+    ('request_seconds', 'Время ответа', DURATION_BUCKETS, 'total'),
+    ('sql_seconds', 'Время SQL-запросов', DURATION_BUCKETS, 'sql'),
+    ('sql_queries', 'Число SQL-запросов', QUERY_BUCKETS, 'queries'),
+    ('serializer_seconds', 'Время сериализаторов', DURATION_BUCKETS,
+     'serializer'),
+    ('render_seconds', 'Время рендеринга ответа', DURATION_BUCKETS,
+     'render'),
+)
+
+# Замеры текущего запроса. Переменная контекста переходит в потоки,
+# где sync_to_async выполняет синхронный код, поэтому SQL считается и
+# там, где под ASGI работают вьюхи.
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+def metrics_enabled():
+    return cache.get(METRICS_ENABLED_KEY, settings.METRICS_ENABLED)
+
+
+def set_metrics_enabled(enabled):
+    cache.set(METRICS_ENABLED_KEY, enabled, None)
+
+
+class RequestMetrics:
+    """Замеры одного запроса: SQL, сериализаторы и рендеринг.
+
+    Время сериализаторов включает SQL, который они выполняют сами.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.serializer = 0.0
+        self.render = 0.0
+        self.total = 0.0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql += time.perf_counter() - started
+
+    @contextmanager
+    def track_sql(self):
+        """Считает SQL внутри блока в любом потоке с его контекстом."""
+        token = current_metrics.set(self)
+        try:
+            yield self
+        finally:
+            current_metrics.reset(token)
+
+    def timed(self, attribute, method):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                setattr(self, attribute, getattr(self, attribute)
+                        + time.perf_counter() - started)
+        return wrapper
+
+    def server_timing(self):
+        return ', '.join((
+            f'db;dur={self.sql * 1000:.1f};desc="SQL: {self.queries}"',
+            f'serializer;dur={self.serializer * 1000:.1f}',
+            f'render;dur={self.render * 1000:.1f}',
+            f'total;dur={self.total * 1000:.1f}',
+        ))
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics.execute_wrapper(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_execute_wrapper(sender, connection, **kwargs):
+    """Обёртка SQL на каждом подключении, в каком бы потоке оно ни было."""
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """Гистограммы по вьюхам в памяти процесса.
+
+    Как и кэш по умолчанию, данные у каждого процесса свои.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, labels, metrics):
+        with self.lock:
+            for name, _, buckets, attribute in HISTOGRAMS:
+                histogram = self.histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self.histograms[(name, labels)] = Histogram(
+                        buckets
+                    )
+                histogram.observe(getattr(metrics, attribute))
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus."""
+        lines = [
+            f'# TYPE {METRICS_PREFIX}_metrics_enabled gauge',
+            f'{METRICS_PREFIX}_metrics_enabled {int(metrics_enabled())}',
+        ]
+        with self.lock:
+            for name, description, buckets, _ in HISTOGRAMS:
+                metric = f'{METRICS_PREFIX}_{name}'
+                lines.append(f'# HELP {metric} {description}')
+                lines.append(f'# TYPE {metric} histogram')
+                for (histogram_name, labels), histogram in sorted(
+                    self.histograms.items()
+                ):
+                    if histogram_name != name:
+                        continue
+                    view, method = labels
+                    label = f'view="{view}",method="{method}"'
+                    for bound, count in zip(buckets, histogram.counts):
+                        lines.append(
+                            f'{metric}_bucket{{{label},le="{bound}"}} {count}'
+                        )
+                    lines.append(
+                        f'{metric}_bucket{{{label},le="+Inf"}} '
+                        f'{histogram.count}'
+                    )
+                    lines.append(f'{metric}_sum{{{label}}} {histogram.sum}')
+                    lines.append(
+                        f'{metric}_count{{{label}}} {histogram.count}'
+                    )
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """Меряет запрос, если метрики включены.
+
+    SQL считается обёрткой на всех подключениях к базам, сериализаторы
+    и рендеринг — хуками DRF. Итог уходит в заголовок Server-Timing и в
+    гистограммы по вьюхам.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not metrics_enabled():
+            return self.get_response(request)
+        metrics = request.metrics = RequestMetrics()
+        started = time.perf_counter()
+        with metrics.track_sql():
+            response = self.get_response(request)
+        return self.finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        if not metrics_enabled():
+            return await self.get_response(request)
+        metrics = request.metrics = RequestMetrics()
+        started = time.perf_counter()
+        with metrics.track_sql():
+            response = await self.get_response(request)
+        return self.finish(request, response, metrics, started)
+
+    @staticmethod
+    def finish(request, response, metrics, started):
+        metrics.total = time.perf_counter() - started
+        response['Server-Timing'] = metrics.server_timing()
+        match = request.resolver_match
+        if match is not None:
+            registry.observe(
+                (match.view_name or match.route, request.method), metrics
+            )
+        return response
+
+
+class SerializerTimingMixin:
+    """Засекает время сериализаторов вьюхи для метрик запроса."""
+
+    def timed_serialization(self, function):
+        metrics = getattr(self.request, 'metrics', None)
+        if metrics is None:
+            return function
+        return metrics.timed('serializer', function)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if getattr(self.request, 'metrics', None) is not None:
+            for method in ('to_representation', 'run_validation'):
+                setattr(serializer, method, self.timed_serialization(
+                    getattr(serializer, method)
+                ))
+        return serializer
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer, который засекает время рендеринга для метрик."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        request = (renderer_context or {}).get('request')
+        metrics = getattr(request, 'metrics', None)
+        if metrics is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return metrics.timed('render', super().render)(
+            data, accepted_media_type, renderer_context
+        )
@@ -0,0 +1,8 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class IgnoreFormatNegotiation(DefaultContentNegotiation):
+    """Всегда выбирает первый рендерер, не глядя на параметр format."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
@@ -1,5 +1,130 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+from collections import OrderedDict
+from datetime import datetime
+
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from recipes.models import after_cursor
 
 
 class LimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPagination(BasePagination):
+    """Постраничный вывод рецептов по курсору (pub_date, id).
+
+    Следующая страница выбирается условием по ключу сортировки, без
+    COUNT и OFFSET, поэтому время не растёт с глубиной прокрутки.
+    Пустой параметр cursor означает первую страницу. С параметрами из
+    ordered_params, которые задают свой порядок, например поиском по
+    релевантности, курсор не сочетается: запрос отклоняется, а не
+    теряет этот порядок.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    ordered_params = ('search',)
+    invalid_cursor_message = 'Неверный курсор'
+    ordered_param_message = 'Курсор нельзя сочетать с параметром {}'
+
+    def encode_cursor(self, recipe):
+        if isinstance(recipe, dict):
+            pub_date, pk = recipe['pub_date'], recipe['id']
+        else:
+            pub_date, pk = recipe.pub_date, recipe.id
+        value = f'{pub_date.isoformat()}|{pk}'
+        return base64.urlsafe_b64encode(value.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            pub_date, pk = base64.urlsafe_b64decode(
+                encoded.encode()
+            ).decode().split('|')
+            return datetime.fromisoformat(pub_date), int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def check_ordering(self, request):
+        for param in self.ordered_params:
+            if request.query_params.get(param):
+                raise ValidationError({
+                    self.cursor_query_param: [
+                        self.ordered_param_message.format(param)
+                    ]
+                })
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.check_ordering(request)
+        page_size = self.get_page_size(request)
+        queryset = after_cursor(
+            queryset.order_by('-pub_date', '-id'), self.decode_cursor(request)
+        )
+        page = list(queryset[:page_size + 1])
+        self.next_cursor = (
+            self.encode_cursor(page[page_size - 1])
+            if len(page) > page_size else None
+        )
+        return page[:page_size]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor,
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class FeedCursorPagination(RecipeCursorPagination):
+    """Курсор по ленте подписок.
+
+    Вместо queryset принимает функцию, которая по курсору и размеру
+    страницы возвращает ключи (pub_date, id) рецептов ленты.
+    """
+
+    def paginate_queryset(self, page_keys, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        keys = page_keys(self.decode_cursor(request), page_size + 1)
+        self.next_cursor = None
+        if len(keys) > page_size:
+            pub_date, pk = keys[page_size - 1]
+            self.next_cursor = self.encode_cursor(
+                {'pub_date': pub_date, 'id': pk}
+            )
+        return keys[:page_size]
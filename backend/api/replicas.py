@@ -0,0 +1,163 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.permissions import SAFE_METHODS
+
+# Алиас базы для чтения в текущем запросе, None — основная база.
+read_alias = ContextVar('read_alias', default=None)
+
+
+def pin_key(user_id):
+    return f'replica:pin:user:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Читать данные пользователя с основной базы, пока реплики догоняют."""
+    cache.set(pin_key(user_id), True, settings.DB_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user):
+    return user.is_authenticated and cache.get(pin_key(user.id), False)
+
+
+class ReplicaHealth:
+    """Доступность реплик, проверенная не чаще раза в интервал.
+
+    Состояние своё у каждого процесса. Недоступная реплика
+    пропускается до следующей проверки.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked = {}
+
+    @staticmethod
+    def check(alias):
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except DatabaseError:
+            connections[alias].close()
+            return False
+        return True
+
+    def is_healthy(self, alias):
+        interval = settings.DB_REPLICA_HEALTH_CHECK_INTERVAL
+        if not interval:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            checked_at, healthy = self.checked.get(alias, (None, True))
+            if checked_at is not None and now - checked_at < interval:
+                return healthy
+            # Пока идёт проверка, остальные берут прежний результат.
+            self.checked[alias] = (now, healthy)
+        healthy = self.check(alias)
+        with self.lock:
+            self.checked[alias] = (now, healthy)
+        return healthy
+
+
+health = ReplicaHealth()
+
+
+def choose_replica():
+    """Случайная доступная реплика или None, если таких нет."""
+    replicas = [
+        alias for alias in settings.DB_REPLICAS if health.is_healthy(alias)
+    ]
+    return random.choice(replicas) if replicas else None
+
+
+@contextmanager
+def on_primary():
+    """Читает с основной базы внутри блока.
+
+    Нужно там, где прочитанное попадает в кэш по уже новой версии:
+    отставшая реплика положила бы туда старые данные.
+    """
+    token = read_alias.set(None)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """Чтения направляет в алиас из read_alias, записи — в основную базу.
+
+    Реплики получают схему репликацией, миграции на них не выполняются.
+    """
+
+    def db_for_read(self, model, **hints):
+        return read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMixin:
+    """Безопасные запросы вьюхи читают с реплики.
+
+    Пользователь определяется по основной базе, реплика выбирается
+    уже после проверок доступа. Пользователь, недавно что-то менявший,
+    читает с основной базы, чтобы видеть свои изменения. replica_actions
+    ограничивает действия вьюсета, None — все безопасные. sticky_reads
+    выключают эту проверку там, где пользователь определяется лениво и
+    своих данных в ответе нет.
+    """
+
+    replica_actions = None
+    sticky_reads = True
+
+    def dispatch(self, request, *args, **kwargs):
+        token = read_alias.set(None)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            read_alias.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not settings.DB_REPLICAS or request.method not in SAFE_METHODS:
+            return
+        if (
+            self.replica_actions is not None
+            and getattr(self, 'action', None) not in self.replica_actions
+        ):
+            return
+        if not (self.sticky_reads and is_pinned(request.user)):
+            read_alias.set(choose_replica())
+
+
+class ReplicaPinMiddleware(MiddlewareMixin):
+    """После успешной записи пользователь читает с основной базы.
+
+    Срок задаёт DB_REPLICA_PIN_SECONDS, он должен покрывать отставание
+    реплик. Отметка хранится в кэше по умолчанию.
+    """
+
+    def process_response(self, request, response):
+        user = getattr(request, 'user', None)
+        if (
+            settings.DB_REPLICAS
+            and request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and user is not None
+            and user.is_authenticated
+        ):
+            pin_to_primary(user.id)
+        return response
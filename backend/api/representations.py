@@ -0,0 +1,230 @@
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .fields import image_variants
+from .replicas import on_primary
+from recipes.cache import get_versions
+from recipes.models import IngredientRecipe, Recipe
+from users.serializers import get_following_ids
+
+RECIPE_CACHE_TIMEOUT = 60 * 60 * 24
+# Сколько живёт блокировка пересборки представления и сколько другие
+# запросы ждут, пока пересборка закончится.
+REBUILD_LOCK_TIMEOUT = 10
+REBUILD_WAIT = 2.0
+REBUILD_POLL = 0.05
+
+RECIPE_ROW_FIELDS = (
+    'id', 'pub_date', 'author_id', 'is_favorited', 'is_in_shopping_cart',
+)
+SHARED_ROW_FIELDS = (
+    'id', 'name', 'image', 'variants_image', 'text', 'cooking_time',
+    'author_id',
+    'author__email', 'author__username', 'author__first_name',
+    'author__last_name',
+)
+
+
+def recipe_rows(queryset):
+    """Строки рецептов для recipe_representations вместо объектов."""
+    return queryset.prefetch_related(None).values(*RECIPE_ROW_FIELDS)
+
+
+def tags_by_recipe(recipe_ids):
+    tags = defaultdict(list)
+    links = Recipe.tags.through.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by('tag_id').values_list(
+        'recipe_id', 'tag_id', 'tag__name', 'tag__color', 'tag__slug'
+    )
+    for recipe_id, tag_id, name, color, slug in links:
+        tags[recipe_id].append({
+            'id': tag_id,
+            'name': name,
+            'color': color,
+            'slug': slug,
+        })
+    return tags
+
+
+def ingredients_by_recipe(recipe_ids):
+    ingredients = defaultdict(list)
+    links = IngredientRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by('id').values_list(
+        'recipe_id', 'ingredient_id', 'ingredient__name',
+        'ingredient__measurement_unit', 'amount'
+    )
+    for recipe_id, ingredient_id, name, measurement_unit, amount in links:
+        ingredients[recipe_id].append({
+            'id': ingredient_id,
+            'name': name,
+            'measurement_unit': measurement_unit,
+            'amount': amount,
+        })
+    return ingredients
+
+
+def build_shared(recipe_ids):
+    """Общая для всех пользователей часть представлений рецептов.
+
+    Ссылки на картинки относительные: адрес сайта берётся из запроса
+    при выдаче.
+    """
+    tags = tags_by_recipe(recipe_ids)
+    ingredients = ingredients_by_recipe(recipe_ids)
+    storage = Recipe._meta.get_field('image').storage
+    rows = Recipe.objects.filter(id__in=recipe_ids).order_by().values(
+        *SHARED_ROW_FIELDS
+    )
+    return {
+        row['id']: {
+            'id': row['id'],
+            'tags': tags[row['id']],
+            'author': {
+                'email': row['author__email'],
+                'id': row['author_id'],
+                'username': row['author__username'],
+                'first_name': row['author__first_name'],
+                'last_name': row['author__last_name'],
+            },
+            'ingredients': ingredients[row['id']],
+            'name': row['name'],
+            'image': storage.url(row['image']) if row['image'] else None,
+            'image_variants': (
+                image_variants(storage, row['image'])
+                if row['image'] and row['variants_image'] == row['image']
+                else {}
+            ),
+            'text': row['text'],
+            'cooking_time': row['cooking_time'],
+        }
+        for row in rows
+    }
+
+
+def representation_cache():
+    return caches[settings.REPRESENTATION_CACHE]
+
+
+def cache_keys(rows):
+    """Ключи кэша общих представлений по id рецепта.
+
+    В ключ входят версии тэгов, ингредиентов, самого рецепта и его
+    автора, их меняют сигналы.
+    """
+    names = {'tags', 'ingredients'}
+    for row in rows:
+        names.add(f'recipe:{row["id"]}')
+        names.add(f'user:{row["author_id"]}')
+    versions = get_versions(names)
+    return {
+        row['id']: 'representation:recipe:{}:{}:{}:{}:{}'.format(
+            row['id'],
+            versions['tags'],
+            versions['ingredients'],
+            versions[f'recipe:{row["id"]}'],
+            versions[f'user:{row["author_id"]}'],
+        )
+        for row in rows
+    }
+
+
+def wait_for_rebuild(keys):
+    """Ждёт представления, которые пересобирает другой запрос."""
+    cache = representation_cache()
+    found = {}
+    deadline = time.monotonic() + REBUILD_WAIT
+    while len(found) < len(keys) and time.monotonic() < deadline:
+        time.sleep(REBUILD_POLL)
+        found.update(cache.get_many(
+            [key for key in keys.values() if key not in found]
+        ))
+    return {pk: found[key] for pk, key in keys.items() if key in found}
+
+
+def shared_representations(keys):
+    """Общие части представлений из кэша по ключам {id рецепта: ключ}.
+
+    Промах пересобирает только один запрос, взявший блокировку через
+    cache.add, остальные ждут его результата. Если дождаться не вышло,
+    представление собирается без записи в кэш. Пересборка читает с
+    основной базы: ключ уже с новой версией, а реплика может отставать.
+    """
+    cache = representation_cache()
+    found = cache.get_many(keys.values())
+    shared = {pk: found[key] for pk, key in keys.items() if key in found}
+    missing = {pk: key for pk, key in keys.items() if pk not in shared}
+    if not missing:
+        return shared
+    locks = {
+        pk: f'lock:{key}' for pk, key in missing.items()
+        if cache.add(f'lock:{key}', True, REBUILD_LOCK_TIMEOUT)
+    }
+    if locks:
+        try:
+            with on_primary():
+                built = build_shared(list(locks))
+            cache.set_many(
+                {missing[pk]: recipe for pk, recipe in built.items()},
+                RECIPE_CACHE_TIMEOUT,
+            )
+        finally:
+            cache.delete_many(locks.values())
+        shared.update(built)
+    waiting = {pk: key for pk, key in missing.items() if pk not in locks}
+    if waiting:
+        shared.update(wait_for_rebuild(waiting))
+        rest = [pk for pk in waiting if pk not in shared]
+        if rest:
+            shared.update(build_shared(rest))
+    return shared
+
+
+def recipe_representations(rows, request):
+    """Рецепты в том же виде, что и RecipeGetSerializer, но без DRF.
+
+    Общая для всех часть берётся из кэша, флаги избранного, списка
+    покупок и подписки на автора — из строк recipe_rows и подписок
+    пользователя. Порядок ключей и значения должны совпадать с
+    сериализатором байт в байт: при изменении RecipeGetSerializer
+    меняется и эта функция. Рецепты, удалённые после выборки строк,
+    пропускаются.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    shared = shared_representations(cache_keys(rows))
+    following = (
+        get_following_ids(request) if request.user.is_authenticated
+        else ()
+    )
+    absolute = request.build_absolute_uri
+    representations = []
+    for row in rows:
+        recipe = shared.get(row['id'])
+        if recipe is None:
+            continue
+        representations.append({
+            'id': recipe['id'],
+            'tags': recipe['tags'],
+            'author': {
+                **recipe['author'],
+                'is_subscribed': row['author_id'] in following,
+            },
+            'ingredients': recipe['ingredients'],
+            'is_favorited': row['is_favorited'],
+            'is_in_shopping_cart': row['is_in_shopping_cart'],
+            'name': recipe['name'],
+            'image': recipe['image'] and absolute(recipe['image']),
+            'image_variants': {
+                width: absolute(url)
+                for width, url in recipe['image_variants'].items()
+            },
+            'text': recipe['text'],
+            'cooking_time': recipe['cooking_time'],
+        })
+    return representations
@@ -1,14 +1,20 @@
 from django.core.validators import MinValueValidator
 from django.db import transaction
-from django.shortcuts import get_object_or_404
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
 
 from recipes.models import (FavoriteRecipe, Ingredient, IngredientRecipe,
-                            Recipe, ShoppingCart, Tag)
+                            Recipe, ShoppingCart, Tag,
+                            recipe_ingredients_changed)
 from users.models import Follow, User
-from users.serializers import CurrentUserSerializer
-from .fields import HexToNameColor
+from users.serializers import (AuthorRecipesListSerializer,
+                               AuthorRecipesMixin, CurrentUserSerializer)
+from .fields import (HashedBase64ImageField, HexToNameColor,
+                     ImageVariantsField)
+
+MAX_BULK_RECIPES = 500
+MAX_BULK_AUTHORS = 100
 
 
 class TagSerializers(serializers.ModelSerializer):
@@ -52,7 +58,7 @@ class AmountSerializer(serializers.ModelSerializer):
 class RecipePostSerializer(serializers.ModelSerializer):
     author = CurrentUserSerializer(read_only=True)
     name = serializers.CharField()
-    image = Base64ImageField()
+    image = HashedBase64ImageField()
     tags = serializers.PrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
         many=True
@@ -71,16 +77,46 @@ class RecipePostSerializer(serializers.ModelSerializer):
                   'name', 'image', 'text', 'cooking_time',)
 
     def add_ingredients(self, recipe, ingredients):
-        ingredients_recipe = list()
-        for ingredient in ingredients:
-            ingredients_recipe.append(
-                IngredientRecipe(
-                    ingredient_id=ingredient.get('id'),
-                    amount=ingredient.get('amount'),
-                    recipe=recipe,
-                )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                ingredient_id=ingredient.get('id'),
+                amount=ingredient.get('amount'),
+                recipe=recipe,
+            )
+            for ingredient in ingredients
+        )
+
+    def update_ingredients(self, recipe, ingredients):
+        """Приводит ингредиенты рецепта к новому списку.
+
+        Удаляются только убранные ингредиенты, количество обновляется
+        только у изменившихся, добавляются только новые.
+        """
+        amounts = {
+            int(ingredient['id']): int(ingredient['amount'])
+            for ingredient in ingredients
+        }
+        removed = []
+        changed = []
+        for link in IngredientRecipe.objects.filter(recipe=recipe):
+            amount = amounts.pop(link.ingredient_id, None)
+            if amount is None:
+                removed.append(link.id)
+            elif amount != link.amount:
+                link.amount = amount
+                changed.append(link)
+        if removed:
+            IngredientRecipe.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ('amount',))
+        self.add_ingredients(recipe, (
+            {'id': ingredient_id, 'amount': amount}
+            for ingredient_id, amount in amounts.items()
+        ))
+        if removed or changed or amounts:
+            recipe_ingredients_changed.send(
+                IngredientRecipe, recipe_ids=[recipe.id]
             )
-        IngredientRecipe.objects.bulk_create(ingredients_recipe)
 
     def validate(self, data):
         ingredients = self.initial_data.get('ingredients')
@@ -88,17 +124,18 @@ class RecipePostSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({
                 'ingredients': 'Должен быть хотя бы один ингредиент'
             })
-        ingredient_list = []
-        for ingredient_item in ingredients:
-            ingredient = get_object_or_404(
-                Ingredient,
-                id=ingredient_item['id']
+        ingredient_ids = {
+            int(ingredient_item['id']) for ingredient_item in ingredients
+        }
+        if len(ingredient_ids) != len(ingredients):
+            raise serializers.ValidationError(
+                'Ингредиенты должны быть уникальными'
             )
-            if ingredient in ingredient_list:
-                raise serializers.ValidationError(
-                    'Ингредиенты должны быть уникальными'
-                )
-            ingredient_list.append(ingredient)
+        if len(Ingredient.objects.in_bulk(ingredient_ids)) != len(
+            ingredient_ids
+        ):
+            raise NotFound()
+        for ingredient_item in ingredients:
             if int(ingredient_item['amount']) < 0:
                 raise serializers.ValidationError(
                     'Убедитесь, что количество ингредиентов больше 0'
@@ -111,29 +148,17 @@ class RecipePostSerializer(serializers.ModelSerializer):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
+        recipe.tags.set(tags)
         self.add_ingredients(recipe, ingredients)
-        for tag in tags:
-            recipe.tags.add(get_object_or_404(Tag, pk=tag.id))
-        recipe.save()
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
-        instance.name = validated_data.get('name', instance.name)
-        instance.image = validated_data.get('image', instance.image)
-        instance.text = validated_data.get('text', instance.text)
-        instance.cooking_time = validated_data.get(
-            'cooking_time',
-            instance.cooking_time
-        )
-        instance.tags.clear()
-        instance.ingredients.clear()
-        IngredientRecipe.objects.filter(recipe=instance).delete()
         ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
-        for tag in tags:
-            instance.tags.add(get_object_or_404(Tag, pk=tag.id))
-        self.add_ingredients(instance, ingredients)
+        tags = validated_data.pop('tags', None)
+        if tags is not None:
+            instance.tags.set(tags)
+        self.update_ingredients(instance, ingredients)
         return super().update(instance, validated_data)
 
 
@@ -143,6 +168,7 @@ class RecipeGetSerializer(serializers.ModelSerializer):
     author = CurrentUserSerializer(read_only=True)
     tags = TagSerializers(read_only=True, many=True)
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
     ingredients = IngredientInRecipeSerializer(
         source='resipe_ingredient',
         required=True,
@@ -152,10 +178,12 @@ class RecipeGetSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time',)
+                  'is_in_shopping_cart', 'name', 'image', 'image_variants',
+                  'text', 'cooking_time',)
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if not request.user.is_authenticated:
             return False
@@ -163,6 +191,8 @@ class RecipeGetSerializer(serializers.ModelSerializer):
             user=request.user, recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if not request.user.is_authenticated:
             return False
@@ -170,13 +200,32 @@ class RecipeGetSerializer(serializers.ModelSerializer):
             user=request.user, recipe=obj).exists()
 
 
-class ShortRecipeSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time',)
+class RecipeIdsSerializer(serializers.Serializer):
+    """Id рецептов для массового добавления и удаления."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES,
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
+class AuthorIdsSerializer(serializers.Serializer):
+    """Id авторов для массовой подписки и отписки."""
+    authors = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_AUTHORS,
+    )
 
+    def validate_authors(self, value):
+        return list(dict.fromkeys(value))
 
-class SubscriptionsSerializer(serializers.ModelSerializer):
+
+class SubscriptionsSerializer(AuthorRecipesMixin,
+                              serializers.ModelSerializer):
     id = serializers.ReadOnlyField(source='author.id')
     username = serializers.ReadOnlyField(source='author.username')
     email = serializers.ReadOnlyField(source='author.email')
@@ -190,28 +239,16 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
         model = Follow
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipes_count',)
+        list_serializer_class = AuthorRecipesListSerializer
 
-    def get_recipes(self, obj):
-        recipes = Recipe.objects.filter(author=obj.author)
-        recipes_limit = self.context['request'].query_params.get(
-            'recipes_limit'
-        )
-        if recipes_limit:
-            return ShortRecipeSerializer(
-                recipes[:int(recipes_limit)],
-                many=True
-            ).data
-        return ShortRecipeSerializer(recipes, many=True).data
-
-    def get_recipes_count(self, obj):
-        recipes = Recipe.objects.filter(author=obj.author)
-        return recipes.count()
+    def get_author(self, obj):
+        return obj.author
 
     def get_is_subscribed(self, obj):
         return CurrentUserSerializer.get_is_subscribed(self, obj.author)
 
 
-class IsSubscribeSerializer(serializers.ModelSerializer):
+class IsSubscribeSerializer(AuthorRecipesMixin, serializers.ModelSerializer):
     recipes = serializers.SerializerMethodField(read_only=True)
     recipes_count = serializers.SerializerMethodField(read_only=True)
     is_subscribed = serializers.SerializerMethodField(read_only=True)
@@ -220,20 +257,7 @@ class IsSubscribeSerializer(serializers.ModelSerializer):
         model = User
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipes_count',)
-
-    def get_recipes(self, obj):
-        recipes = Recipe.objects.filter(author_id=obj.id)
-        serializer = ShortRecipeSerializer(recipes, many=True)
-        return serializer.data
-
-    def get_recipes_count(self, obj):
-        recipes = Recipe.objects.filter(author_id=obj.id)
-        return recipes.count()
+        list_serializer_class = AuthorRecipesListSerializer
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if request and hasattr(request, 'user'):
-            return (request.user.is_authenticated
-                    and request.user.follower.filter(follow=obj)
-                    .exists())
-        return False
+        return CurrentUserSerializer.get_is_subscribed(self, obj)
@@ -0,0 +1,486 @@
+import json
+import re
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.db import connection
+from django.http import HttpResponse
+from django.test import (AsyncClient, RequestFactory, SimpleTestCase,
+                         TestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import (APIClient, APIRequestFactory,
+                                 force_authenticate)
+from rest_framework.views import APIView
+
+from . import replicas
+from .async_views import async_variant
+from .representations import recipe_representations, recipe_rows
+from .serializers import RecipeGetSerializer
+from recipes.cache import bump_version
+from recipes.models import (FavoriteRecipe, FeedEntry, Ingredient,
+                            IngredientRecipe, Recipe, ShoppingCart, Tag)
+from users.models import Follow, User
+
+
+def create_user(name):
+    return User.objects.create_user(
+        email=f'{name}@example.com', username=name,
+        first_name='Имя', last_name='Фамилия', password='pass12345!'
+    )
+
+
+def create_recipes(authors, count):
+    """Рецепты с тэгами и ингредиентами, по очереди у каждого автора."""
+    tags = [
+        Tag.objects.create(name=f'Тэг {number}', color=f'#00000{number}',
+                           slug=f'tag{number}')
+        for number in range(3)
+    ]
+    ingredients = [
+        Ingredient.objects.create(name=f'Ингредиент {number}',
+                                  measurement_unit='г')
+        for number in range(5)
+    ]
+    recipes = []
+    for number in range(count):
+        recipe = Recipe.objects.create(
+            author=authors[number % len(authors)], name=f'Рецепт {number}',
+            image='recipes/x.png', text='Текст', cooking_time=5
+        )
+        recipe.tags.set(tags[:number % len(tags) + 1])
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                             amount=amount)
+            for amount, ingredient in enumerate(ingredients, start=1)
+        )
+        recipes.append(recipe)
+    return recipes
+
+
+def clear_caches():
+    cache.clear()
+    caches['representations'].clear()
+
+
+class CatalogCacheTests(TestCase):
+    """Кэш ответов справочников по версии."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Завтрак', color='#000001',
+                                     slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(name='соль',
+                                                   measurement_unit='г')
+
+    def setUp(self):
+        clear_caches()
+
+    def test_not_modified(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_cached_until_version_changes(self):
+        body = self.client.get('/api/tags/').content
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/tags/').content, body)
+        bump_version('tags')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/tags/').content, body)
+
+    def test_keys_per_address(self):
+        url = f'/api/tags/{self.tag.id}/'
+        self.client.get('/api/tags/')
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json()['slug'], 'breakfast')
+
+    def test_tag_change(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Обед', color='#000002', slug='lunch')
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(
+            [tag['slug'] for tag in response.json()], ['breakfast', 'lunch']
+        )
+
+    def test_ingredient_change(self):
+        url = f'/api/ingredients/{self.ingredient.id}/'
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ingredient.name = 'сахар'
+            self.ingredient.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'сахар')
+
+
+class RecipeListQueriesTests(TestCase):
+    """Число запросов списка рецептов не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author = create_user('user'), create_user('author')
+        recipes = create_recipes([cls.author], 100)
+        Follow.objects.create(user=cls.user, author=cls.author)
+        for recipe in recipes[::2]:
+            FavoriteRecipe.objects.create(user=cls.user, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def list_queries(self, client, limit):
+        clear_caches()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f'/api/recipes/?limit={limit}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), limit)
+        return len(queries)
+
+    def check_constant(self, client):
+        expected = self.list_queries(client, 1)
+        for limit in (2, 10, 50, 100):
+            with self.subTest(limit=limit):
+                clear_caches()
+                with self.assertNumQueries(expected):
+                    client.get(f'/api/recipes/?limit={limit}')
+
+    def test_anonymous(self):
+        self.check_constant(APIClient())
+
+    def test_authenticated(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.check_constant(client)
+
+    def serializer_queries(self, user, count):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user
+        recipes = Recipe.objects.with_related().with_user_flags(user)[:count]
+        with CaptureQueriesContext(connection) as queries:
+            data = RecipeGetSerializer(
+                recipes, many=True, context={'request': request}
+            ).data
+        self.assertEqual(len(data), count)
+        self.assertTrue(all(recipe['tags'] for recipe in data))
+        self.assertTrue(all(recipe['ingredients'] for recipe in data))
+        return len(queries)
+
+    def test_serializer(self):
+        """with_related: RecipeGetSerializer без запросов на рецепт."""
+        for user in (AnonymousUser(), self.user):
+            expected = self.serializer_queries(user, 1)
+            for count in (10, 100):
+                with self.subTest(user=user, count=count):
+                    self.assertEqual(
+                        self.serializer_queries(user, count), expected
+                    )
+
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsTests(TestCase):
+    """Замеры запросов под WSGI и ASGI."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов', password='pass12345!'
+        )
+        Recipe.objects.create(
+            author=author, name='Рецепт', image='recipes/x.png',
+            text='Текст', cooking_time=5
+        )
+
+    def assert_sql_counted(self, response):
+        self.assertEqual(response.status_code, 200)
+        queries = re.search(r'SQL: (\d+)', response['Server-Timing'])
+        self.assertGreater(int(queries.group(1)), 0)
+
+    def test_sync(self):
+        self.assert_sql_counted(self.client.get('/api/recipes/'))
+
+    async def test_async(self):
+        self.assert_sql_counted(await AsyncClient().get('/api/recipes/'))
+
+
+class RecipeRepresentationsTests(TestCase):
+    """recipe_representations совпадает с RecipeGetSerializer."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.subscriber, cls.stranger = (
+            create_user(name) for name in ('author', 'subscriber', 'stranger')
+        )
+        recipes = create_recipes([cls.author, cls.stranger], 6)
+        Recipe.objects.filter(id=recipes[-1].id).update(image='')
+        Follow.objects.create(user=cls.subscriber, author=cls.author)
+        for recipe in recipes[::2]:
+            FavoriteRecipe.objects.create(user=cls.subscriber, recipe=recipe)
+        for recipe in recipes[1::2]:
+            ShoppingCart.objects.create(user=cls.subscriber, recipe=recipe)
+
+    def setUp(self):
+        clear_caches()
+
+    def check_parity(self, user):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user
+        queryset = Recipe.objects.with_related().with_user_flags(
+            user
+        ).defer('search_vector')
+        expected = json.dumps(RecipeGetSerializer(
+            queryset, many=True, context={'request': request}
+        ).data)
+        # Второй раз общие части берутся из кэша.
+        for _ in range(2):
+            self.assertEqual(json.dumps(recipe_representations(
+                recipe_rows(queryset), request
+            )), expected)
+
+    def test_anonymous(self):
+        self.check_parity(AnonymousUser())
+
+    def test_subscribed(self):
+        self.check_parity(self.subscriber)
+
+    def test_not_subscribed(self):
+        self.check_parity(self.stranger)
+
+
+class TokenAuthenticationTests(TestCase):
+    """Кэш токенов хранит только id пользователя."""
+
+    def setUp(self):
+        clear_caches()
+        self.user = create_user('user')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(
+            Token.objects.create(user=self.user).key
+        ))
+        # Первый запрос кладёт токен в кэш.
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+
+    def test_logout_invalidates_token(self):
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_user_is_fresh(self):
+        User.objects.filter(pk=self.user.pk).update(first_name='Другое')
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.json()['first_name'], 'Другое')
+
+    def test_inactive_user(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+
+class AsyncVariantTests(SimpleTestCase):
+    """В пуле асинхронных вьюх выполняются только безопасные запросы."""
+
+    @staticmethod
+    def view(request):
+        return HttpResponse(threading.current_thread().name)
+
+    async def thread_name(self, method):
+        request = getattr(RequestFactory(), method)('/')
+        response = await async_variant(self.view)(request)
+        return response.content.decode()
+
+    async def test_read_runs_in_pool(self):
+        self.assertTrue(
+            (await self.thread_name('get')).startswith('async-read')
+        )
+
+    async def test_write_runs_in_sync_thread(self):
+        for method in ('post', 'put', 'patch', 'delete'):
+            with self.subTest(method=method):
+                self.assertFalse(
+                    (await self.thread_name(method)).startswith('async-read')
+                )
+
+
+class RecipeCursorTests(TestCase):
+    """Курсор по рецептам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_recipes([create_user('author')], 7)
+
+    def test_pages(self):
+        ids, url = [], '/api/recipes/?cursor=&limit=3'
+        while url:
+            page = self.client.get(url).json()
+            ids += [recipe['id'] for recipe in page['results']]
+            url = page['next']
+        self.assertEqual(ids, list(Recipe.objects.order_by(
+            '-pub_date', '-id'
+        ).values_list('id', flat=True)))
+
+    def test_search_rejected(self):
+        response = self.client.get('/api/recipes/?cursor=&search=Рецепт')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.json())
+
+
+@override_settings(FEED_FANOUT_LIMIT=1)
+class FeedTests(TestCase):
+    """Лента подписок: раздача и подмешивание при чтении."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.other, cls.author, cls.popular = (
+            create_user(name)
+            for name in ('reader', 'other', 'author', 'popular')
+        )
+        Follow.objects.follow(cls.reader, [cls.author.id, cls.popular.id])
+        Follow.objects.follow(cls.other, [cls.popular.id])
+        create_recipes([cls.author, cls.popular], 7)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def feed(self):
+        ids, url = [], '/api/recipes/feed/?limit=2'
+        while url:
+            page = self.client.get(url).json()
+            ids += [recipe['id'] for recipe in page['results']]
+            url = page['next']
+        return ids
+
+    def expected(self, *authors):
+        return list(Recipe.objects.filter(author__in=authors).order_by(
+            '-pub_date', '-id'
+        ).values_list('id', flat=True))
+
+    def entries(self, user, author):
+        return set(FeedEntry.objects.filter(
+            user=user, author=author
+        ).values_list('recipe_id', flat=True))
+
+    def assert_fanout(self, author, fanout):
+        author.refresh_from_db()
+        self.assertIs(author.feed_fanout, fanout)
+
+    def test_fan_out(self):
+        self.assertEqual(
+            self.entries(self.reader, self.author),
+            set(self.expected(self.author))
+        )
+        self.assert_fanout(self.popular, False)
+        self.assertFalse(self.entries(self.reader, self.popular))
+        self.assertFalse(self.entries(self.other, self.popular))
+
+    def test_pages_merge_authors_over_limit(self):
+        self.assertEqual(self.feed(), self.expected(self.author, self.popular))
+
+    def test_unfollow(self):
+        Follow.objects.unfollow(self.reader, [self.author.id])
+        self.assertFalse(self.entries(self.reader, self.author))
+        self.assertEqual(self.feed(), self.expected(self.popular))
+
+    def test_fan_out_pending(self):
+        Follow.objects.unfollow(self.other, [self.popular.id])
+        # Отписка не раздаёт рецепты: это делает фоновая команда.
+        self.assert_fanout(self.popular, False)
+        self.assertFalse(self.entries(self.reader, self.popular))
+        self.assertEqual(self.feed(), self.expected(self.author, self.popular))
+        self.assertEqual(
+            FeedEntry.objects.fan_out_pending(), [self.popular.id]
+        )
+        self.assert_fanout(self.popular, True)
+        self.assertEqual(
+            self.entries(self.reader, self.popular),
+            set(self.expected(self.popular))
+        )
+        self.assertEqual(self.feed(), self.expected(self.author, self.popular))
+        self.assertEqual(FeedEntry.objects.fan_out_pending(), [])
+
+
+class ReadAliasView(replicas.ReplicaReadMixin, APIView):
+    permission_classes = ()
+
+    def get(self, request):
+        if 'fail' in request.query_params:
+            raise ValueError
+        return Response({'alias': replicas.read_alias.get()})
+
+    def post(self, request):
+        return self.get(request)
+
+
+@override_settings(DB_REPLICAS=['replica1'])
+class ReplicaReadTests(TestCase):
+    """Выбор базы для чтения."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.other = create_user('user'), create_user('other')
+
+    def setUp(self):
+        clear_caches()
+        health = replicas.ReplicaHealth()
+        patcher = mock.patch.object(replicas, 'health', health)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(health, 'check', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.middleware = replicas.ReplicaPinMiddleware(
+            lambda request: ReadAliasView.as_view()(request)
+        )
+
+    def request(self, method, user=None, path='/'):
+        request = getattr(APIRequestFactory(), method)(path)
+        if user is not None:
+            force_authenticate(request, user)
+            # DRF определяет пользователя сам, middleware видит Django-запрос.
+            request.user = user
+        else:
+            request.user = AnonymousUser()
+        return self.middleware(request)
+
+    def read_alias(self, user=None):
+        return self.request('get', user).data['alias']
+
+    def test_replica(self):
+        self.assertEqual(self.read_alias(), 'replica1')
+        self.assertEqual(self.read_alias(self.user), 'replica1')
+
+    def test_pinned_after_write(self):
+        self.assertIsNone(self.request('post', self.user).data['alias'])
+        self.assertIsNone(self.read_alias(self.user))
+        self.assertEqual(self.read_alias(self.other), 'replica1')
+        cache.delete(replicas.pin_key(self.user.id))
+        self.assertEqual(self.read_alias(self.user), 'replica1')
+
+    def test_not_pinned_without_replicas(self):
+        with override_settings(DB_REPLICAS=[]):
+            self.request('post', self.user)
+        self.assertEqual(self.read_alias(self.user), 'replica1')
+
+    def test_unhealthy_replica(self):
+        replicas.health.check.return_value = False
+        self.assertIsNone(self.read_alias())
+        replicas.health.check.return_value = True
+        # Результат проверки держится интервал.
+        self.assertIsNone(self.read_alias())
+        self.assertEqual(replicas.health.check.call_count, 1)
+        with override_settings(DB_REPLICA_HEALTH_CHECK_INTERVAL=0):
+            self.assertEqual(self.read_alias(), 'replica1')
+
+    def test_alias_reset(self):
+        self.read_alias()
+        self.assertIsNone(replicas.read_alias.get())
+        with self.assertRaises(ValueError):
+            self.request('get', self.user, '/?fail')
+        self.assertIsNone(replicas.read_alias.get())
@@ -1,8 +1,10 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import (IngredientViewSet, ListSubscriptions, RecipeViewSet,
-                    Subscribe, TagViewSet)
+from .async_views import async_patterns
+from .views import (IngredientViewSet, ListSubscriptions, Metrics,
+                    RecipeViewSet, Subscribe, TagViewSet)
 
 router = DefaultRouter()
 
@@ -10,10 +12,16 @@ router.register('recipes', RecipeViewSet, basename='recipes')
 router.register('tags', TagViewSet, basename='tags')
 router.register('ingredients', IngredientViewSet, basename='ingredients')
 
+router_urls = router.urls
+if settings.ASYNC_READ_VIEWS:
+    router_urls = async_patterns(router_urls)
+
 urlpatterns = [
+    path('metrics/', Metrics.as_view()),
     path('users/subscriptions/', ListSubscriptions.as_view()),
+    path('users/subscribe/', Subscribe.as_view()),
     path('users/<int:pk>/subscribe/', Subscribe.as_view()),
-    path('', include(router.urls)),
+    path('', include(router_urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
 ]
@@ -1,66 +1,154 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import (AllowAny,
+                                        IsAdminUser,
                                         IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from . import serializers
-from .filters import IngredientSearchFilter, RecipeFilter
-from .pagination import LimitPagination
+from .caching import VersionedCacheMixin
+from .exports import (EXPORT_FORMATS, normalize_units,
+                      shopping_cart_ingredients, shopping_cart_response)
+from .filters import RecipeFilter
+from .metrics import (SerializerTimingMixin, registry,
+                      set_metrics_enabled)
+from .negotiation import IgnoreFormatNegotiation
+from .pagination import (FeedCursorPagination, LimitPagination,
+                         RecipeCursorPagination)
 from .permissions import IsAuthorOrAdminPermission
+from .replicas import ReplicaReadMixin
+from .representations import recipe_representations, recipe_rows
 from .serializers import IngredientSerializer
-from recipes.models import (FavoriteRecipe, Ingredient, IngredientRecipe,
-                            Recipe, ShoppingCart, Tag)
+from recipes.index import get_ingredient_index
+from recipes.models import (FavoriteRecipe, FeedEntry, Ingredient, Recipe,
+                            ShoppingCart, Tag)
 from users.models import Follow, User
+from users.serializers import SHORT_RECIPE_FIELDS, ShortRecipeSerializer
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ReplicaReadMixin, SerializerTimingMixin,
+                 VersionedCacheMixin, viewsets.ReadOnlyModelViewSet):
     """Тэги"""
+    sticky_reads = False
     queryset = Tag.objects.all()
     serializer_class = serializers.TagSerializers
     pagination_class = None
+    cache_version_name = 'tags'
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ReplicaReadMixin, SerializerTimingMixin,
+                        VersionedCacheMixin, viewsets.ReadOnlyModelViewSet):
     """Ингредиенты"""
+    sticky_reads = False
     queryset = Ingredient.objects.all()
     permission_classes = AllowAny,
     serializer_class = IngredientSerializer
-    filter_backends = [IngredientSearchFilter]
-    search_fields = '^name',
     pagination_class = None
+    cache_version_name = 'ingredients'
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: Response(
+            get_ingredient_index().search(
+                request.query_params.get('name', '')
+            )
+        ))
 
 
-class ListSubscriptions(generics.ListAPIView):
+class ListSubscriptions(ReplicaReadMixin, SerializerTimingMixin,
+                        generics.ListAPIView):
     """Список покупок"""
     serializer_class = serializers.SubscriptionsSerializer
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
-        return Follow.objects.filter(user=self.request.user)
+        return Follow.objects.filter(
+            user=self.request.user
+        ).select_related('author')
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ReplicaReadMixin, SerializerTimingMixin,
+                    viewsets.ModelViewSet):
     """Рецепты"""
+    replica_actions = ('list', 'retrieve')
     queryset = Recipe.objects.all()
-    permission_classes = IsAuthorOrAdminPermission,
+    permission_classes = IsAuthenticatedOrReadOnly,
     pagination_class = LimitPagination
     serializer_class = serializers.RecipePostSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    lookup_value_regex = r'\d+'
 
     def get_permissions(self):
         if self.action in ('update', 'destroy'):
-            permission_classes = [IsAuthorOrAdminPermission]
-        else:
-            permission_classes = [IsAuthenticatedOrReadOnly]
-        return [permission() for permission in permission_classes]
+            return [IsAuthorOrAdminPermission()]
+        return super().get_permissions()
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if RecipeCursorPagination.cursor_query_param in (
+                self.request.query_params
+            ):
+                self._paginator = RecipeCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        return Recipe.objects.with_related().with_user_flags(
+            self.request.user
+        ).defer('search_vector')
+
+    def list(self, request, *args, **kwargs):
+        """Список рецептов без сериализаторов, из строк .values()."""
+        rows = recipe_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        data = self.timed_serialization(recipe_representations)(
+            rows if page is None else page, request
+        )
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        rows = recipe_rows(self.filter_queryset(self.get_queryset()))
+        row = generics.get_object_or_404(rows, pk=kwargs['pk'])
+        recipes = self.timed_serialization(recipe_representations)(
+            [row], request
+        )
+        if not recipes:
+            raise Http404
+        return Response(recipes[0])
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=(IsAuthenticated, ),
+    )
+    def feed(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь."""
+        paginator = FeedCursorPagination()
+        keys = paginator.paginate_queryset(
+            lambda cursor, size: FeedEntry.objects.page(
+                request.user, cursor, size
+            ),
+            request,
+            self
+        )
+        rows = {
+            row['id']: row for row in recipe_rows(self.get_queryset().filter(
+                id__in=[pk for _, pk in keys]
+            ))
+        }
+        data = self.timed_serialization(recipe_representations)(
+            [rows[pk] for _, pk in keys if pk in rows], request
+        )
+        return paginator.get_paginated_response(data)
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -105,105 +193,182 @@ class RecipeViewSet(viewsets.ModelViewSet):
         detail=False,
         methods=['get'],
         permission_classes=(IsAuthenticated, ),
+        content_negotiation_class=IgnoreFormatNegotiation,
     )
     def download_shopping_cart(self, request):
-        ingredient_list = IngredientRecipe.objects.filter(
-            recipe__recipe_cart__user=request.user).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(sum_amount=Sum('amount'))
-        shopping_list = ['Cписок покупок:\n']
-        shopping_list += '\n'.join([
-            f'{ingredient["ingredient__name"]}'
-            f'({ingredient["ingredient__measurement_unit"]}) - '
-            f'{ingredient["sum_amount"]}'
-            for ingredient in ingredient_list
-        ])
-        filename = 'shopping_cart.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename={filename}'
-        return response
+        export_format = request.query_params.get('format', 'txt')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'format': f'Доступные форматы: {", ".join(EXPORT_FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return shopping_cart_response(request.user, export_format)
 
     @action(
-        detail=True,
-        methods=['post', 'delete'],
+        detail=False,
+        methods=['get'],
+        url_path='shopping_cart/summary',
+        permission_classes=(IsAuthenticated, ),
     )
-    def shopping_cart(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        recipe_in_shopping_cart = ShoppingCart.objects.filter(
-            user=request.user,
-            recipe=recipe
+    def shopping_cart_summary(self, request):
+        """Число рецептов и ингредиенты в списке покупок."""
+        return Response({
+            'recipes': ShoppingCart.objects.filter(user=request.user).count(),
+            'ingredients': [
+                {
+                    'name': ingredient['ingredient__name'],
+                    'measurement_unit': (
+                        ingredient['ingredient__measurement_unit']
+                    ),
+                    'amount': ingredient['sum_amount'],
+                }
+                for ingredient in normalize_units(
+                    shopping_cart_ingredients(request.user)
+                )
+            ],
+        })
+
+    @staticmethod
+    def change_recipe(request, model, pk):
+        """Добавление и удаление одного рецепта в избранном или списке
+        покупок. Повторное добавление и удаление отсутствующего рецепта
+        не ошибка.
+        """
+        if request.method == 'DELETE':
+            model.objects.remove(request.user, [int(pk)])
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        recipe = get_object_or_404(
+            Recipe.objects.only(*SHORT_RECIPE_FIELDS),
+            pk=pk
         )
-        if request.method == 'POST':
-            ShoppingCart.objects.create(user=request.user, recipe=recipe)
-            serializer = serializers.ShortRecipeSerializer(recipe)
-            return Response(serializer.data,
-                            status=status.HTTP_201_CREATED)
-
-        elif request.method == 'DELETE':
-            recipe_in_shopping_cart.delete()
+        model.objects.add(request.user, [recipe.id])
+        return Response(ShortRecipeSerializer(recipe).data,
+                        status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def change_recipes(request, model):
+        """То же для списка id рецептов из тела запроса."""
+        serializer = serializers.RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'DELETE':
+            model.objects.remove(request.user, recipe_ids)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        recipes = list(Recipe.objects.filter(id__in=recipe_ids).only(
+            *SHORT_RECIPE_FIELDS
+        ))
+        missing = set(recipe_ids) - {recipe.id for recipe in recipes}
+        if missing:
             return Response(
-                'Рецепт успешно удалён из списка покупок',
-                status=status.HTTP_204_NO_CONTENT
+                {'recipes': 'Нет рецептов с id: {}'.format(
+                    ', '.join(map(str, sorted(missing)))
+                )},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        model.objects.add(request.user, recipe_ids)
+        return Response(ShortRecipeSerializer(recipes, many=True).data,
+                        status=status.HTTP_201_CREATED)
+
+    @action(
+        detail=True,
+        methods=['post', 'delete'],
+    )
+    def shopping_cart(self, request, pk):
+        return self.change_recipe(request, ShoppingCart, pk)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+    )
+    def shopping_cart_bulk(self, request):
+        return self.change_recipes(request, ShoppingCart)
 
     @action(
         detail=True,
         methods=['post', 'delete'],
     )
     def favorite(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        recipe_in_favorite = FavoriteRecipe.objects.filter(
-            user=request.user,
-            recipe=recipe
-        )
-        if request.method == 'POST':
-            FavoriteRecipe.objects.create(user=request.user, recipe=recipe)
-            serializer = serializers.ShortRecipeSerializer(recipe)
-            return Response(serializer.data,
-                            status=status.HTTP_201_CREATED)
+        return self.change_recipe(request, FavoriteRecipe, pk)
 
-        elif request.method == 'DELETE':
-            recipe_in_favorite.delete()
-            return Response('Рецепт успешно удалён из избранного',
-                            status.HTTP_204_NO_CONTENT)
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite',
+    )
+    def favorite_bulk(self, request):
+        return self.change_recipes(request, FavoriteRecipe)
 
 
 class Subscribe(APIView):
-    """Подписка на пользователя/отписка от пользователя"""
+    """Подписка на пользователя/отписка от пользователя.
+
+    Без pk id авторов берутся из тела запроса. Повторная подписка и
+    отписка от автора, на которого нет подписки, не ошибка.
+    """
     def get_permissions(self):
         permission_classes = (IsAuthenticated,)
         return [permission() for permission in permission_classes]
 
-    def post(self, request, pk):
-        author = get_object_or_404(User, pk=pk)
-        is_subscribed = Follow.objects.filter(user=request.user, author=author)
-        if author == request.user:
+    @staticmethod
+    def get_author_ids(request, pk):
+        if pk is not None:
+            return [pk]
+        serializer = serializers.AuthorIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['authors']
+
+    def post(self, request, pk=None):
+        author_ids = self.get_author_ids(request, pk)
+        if request.user.id in author_ids:
             return Response("Нельзя подписаться на самого себя",
                             status=status.HTTP_400_BAD_REQUEST)
-        elif is_subscribed.exists():
-            return Response(
-                "Вы уже подписались на этого автора.",
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        if pk is not None:
+            authors = [get_object_or_404(User, pk=pk)]
         else:
-            Follow.objects.create(user=request.user, author=author)
-            serializer = serializers.IsSubscribeSerializer(
-                author,
-                context={'request': 'request'}
-            )
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            authors = list(User.objects.filter(id__in=author_ids))
+            missing = set(author_ids) - {author.id for author in authors}
+            if missing:
+                return Response(
+                    {'authors': 'Нет пользователей с id: {}'.format(
+                        ', '.join(map(str, sorted(missing)))
+                    )},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        Follow.objects.follow(request.user, author_ids)
+        serializer = serializers.IsSubscribeSerializer(
+            authors,
+            many=True,
+            context={'request': request}
+        )
+        data = serializer.data
+        return Response(data if pk is None else data[0],
+                        status=status.HTTP_201_CREATED)
 
-    def delete(self, request, pk):
-        author = get_object_or_404(User, pk=pk)
-        subscription = Follow.objects.filter(user=request.user, author=author)
-        if subscription.exists():
-            subscription.delete()
-            return Response(
-                'Вы успешно отписались от этого автора!',
-                status=status.HTTP_204_NO_CONTENT
-            )
-        else:
+    def delete(self, request, pk=None):
+        Follow.objects.unfollow(
+            request.user, self.get_author_ids(request, pk)
+        )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class Metrics(APIView):
+    """Метрики запросов в формате Prometheus и их включение/выключение"""
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return HttpResponse(
+            registry.render(), content_type='text/plain; version=0.0.4'
+        )
+
+    def post(self, request):
+        enabled = request.data.get('enabled')
+        if not isinstance(enabled, bool):
             return Response(
-                'Вы ещё не подписаны на этого автора.',
-                status.HTTP_400_BAD_REQUEST
+                {'enabled': 'Укажите true или false'},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        set_metrics_enabled(enabled)
+        if request.data.get('reset'):
+            registry.clear()
+        return Response({'enabled': enabled})
@@ -37,6 +37,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -44,6 +45,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.replicas.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -66,6 +68,7 @@ TEMPLATES = [
 
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
 
 DATABASES = {
     'default': {
@@ -88,6 +91,46 @@ if DEBUG:
         }
     }
 
+DATABASES['default']['CONN_MAX_AGE'] = int(
+    os.getenv('DB_CONN_MAX_AGE', default=0)
+)
+
+# Реплики для чтения через запятую: host[:port] или, для SQLite, пути к
+# файлам. Остальные параметры берутся у основной базы.
+DB_REPLICAS = []
+# Сколько секунд ждать подключения к реплике. Недоступная реплика
+# обнаруживается проверкой в запросе, поэтому ожидание должно быть коротким.
+DB_REPLICA_CONNECT_TIMEOUT = int(
+    os.getenv('DB_REPLICA_CONNECT_TIMEOUT', default=2)
+)
+for number, replica in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', default='').split(',')), 1
+):
+    alias = f'replica{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    if DATABASES[alias]['ENGINE'] == 'django.db.backends.sqlite3':
+        DATABASES[alias]['NAME'] = replica.strip()
+    else:
+        host, _, port = replica.strip().partition(':')
+        DATABASES[alias]['HOST'] = host
+        DATABASES[alias]['PORT'] = port or DATABASES['default']['PORT']
+        DATABASES[alias]['OPTIONS'] = {
+            **DATABASES['default'].get('OPTIONS', {}),
+            'connect_timeout': DB_REPLICA_CONNECT_TIMEOUT,
+        }
+    DB_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+# Сколько секунд после своей записи пользователь читает с основной базы.
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', default=5))
+# Как часто проверять доступность реплик, 0 — не проверять.
+DB_REPLICA_HEALTH_CHECK_INTERVAL = int(
+    os.getenv('DB_REPLICA_HEALTH_CHECK_INTERVAL', default=10)
+)
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -129,7 +172,12 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ],
+
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 
     'DEFAULT_FILTER_BACKENDS': [
@@ -156,3 +204,63 @@ DJOSER = {
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+# Асинхронные варианты вьюх чтения, включать только под ASGI.
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', default='False') == 'True'
+# Потоки, в которых асинхронные вьюхи работают с ORM.
+ASYNC_READ_WORKERS = int(os.getenv('ASYNC_READ_WORKERS', default=8))
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', default='False') == 'True'
+
+# Рецепты авторов, у которых подписчиков больше, не раздаются в ленты
+# при публикации, а подмешиваются при чтении ленты.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', default=1000))
+
+LOCMEM_CACHE = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+def cache_settings(backend, location, max_entries):
+    """Настройки кэша; MAX_ENTRIES понимает только кэш в памяти процесса."""
+    config = {'BACKEND': backend, 'LOCATION': location}
+    if backend == LOCMEM_CACHE:
+        config['OPTIONS'] = {'MAX_ENTRIES': max_entries}
+    return config
+
+
+# Версии данных, готовые ответы и отметки запросов. Кэш должен быть общим
+# для всех процессов, иначе изменения из другого воркера или команды
+# manage.py не сбросят кэш: в infra/docker-compose.yml это memcached.
+# Кэш в памяти процесса годится только для разработки с одним процессом.
+CACHES = {
+    'default': cache_settings(
+        os.getenv('CACHE_BACKEND', default=LOCMEM_CACHE),
+        os.getenv('CACHE_LOCATION', default=''),
+        int(os.getenv('CACHE_MAX_ENTRIES', default=10000)),
+    ),
+    # Представления рецептов. Ключи содержат версии, поэтому кэш может
+    # быть своим у каждого процесса; записей в нём по одной на рецепт,
+    # MAX_ENTRIES должен покрывать весь каталог.
+    'representations': cache_settings(
+        os.getenv('REPRESENTATION_CACHE_BACKEND', default=LOCMEM_CACHE),
+        os.getenv('REPRESENTATION_CACHE_LOCATION',
+                  default='representations'),
+        int(os.getenv('REPRESENTATION_CACHE_MAX_ENTRIES', default=50000)),
+    ),
+}
+REPRESENTATION_CACHE = 'representations'
+# Id пользователей токенов. По умолчанию хранятся в кэше по умолчанию:
+# выход из аккаунта должен сбрасывать токен во всех процессах сразу.
+TOKEN_CACHE = 'default'
+if os.getenv('TOKEN_CACHE_BACKEND'):
+    CACHES['tokens'] = cache_settings(
+        os.getenv('TOKEN_CACHE_BACKEND'),
+        os.getenv('TOKEN_CACHE_LOCATION', default='tokens'),
+        int(os.getenv('TOKEN_CACHE_MAX_ENTRIES', default=10000)),
+    )
+    TOKEN_CACHE = 'tokens'
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', default=300))
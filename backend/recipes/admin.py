@@ -5,7 +5,7 @@ from . import models
 
 @admin.register(models.Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author')
+    list_display = ('name', 'author', 'favorites_count')
     list_filter = ('author', 'name', 'tags')
     search_fields = ('author__username', 'author__email', 'name')
 
@@ -16,7 +16,33 @@ class IngredientAdmin(admin.ModelAdmin):
     list_filter = ('name', )
 
 
+@admin.register(models.IngredientRecipe)
+class IngredientRecipeAdmin(admin.ModelAdmin):
+    """Изменения пересчитывают списки покупок с рецептом."""
+
+    @staticmethod
+    def ingredients_changed(recipe_ids):
+        models.recipe_ingredients_changed.send(
+            models.IngredientRecipe, recipe_ids=list(recipe_ids)
+        )
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        recipe_ids = {obj.recipe_id}
+        if change and 'recipe' in form.changed_data:
+            recipe_ids.add(form.initial['recipe'])
+        self.ingredients_changed(recipe_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.ingredients_changed([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        self.ingredients_changed(recipe_ids)
+
+
 admin.site.register(models.ShoppingCart)
 admin.site.register(models.Tag)
-admin.site.register(models.IngredientRecipe)
 admin.site.register(models.FavoriteRecipe)
@@ -0,0 +1,48 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _version_key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    """Текущая версия набора данных, хранится в кэше."""
+    key = _version_key(name)
+    version = cache.get(key)
+    if version is not None:
+        return version
+    # Начальное значение берётся от времени, чтобы после вытеснения
+    # ключа из кэша версия не совпала ни с одной из прежних.
+    cache.add(key, time.time_ns(), timeout=None)
+    return cache.get(key)
+
+
+def bump_version(name):
+    """Меняет версию набора данных после изменения данных."""
+    key = _version_key(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def bump_version_on_commit(name):
+    """Меняет версию набора данных после коммита текущей транзакции.
+
+    Раньше коммита нельзя: параллельный запрос успел бы закэшировать
+    старые данные под новой версией.
+    """
+    transaction.on_commit(lambda: bump_version(name))
+
+
+def get_versions(names):
+    """Версии нескольких наборов данных одним обращением к кэшу."""
+    keys = {name: _version_key(name) for name in names}
+    found = cache.get_many(keys.values())
+    return {
+        name: found[key] if key in found else get_version(name)
+        for name, key in keys.items()
+    }
@@ -0,0 +1,93 @@
+import io
+import logging
+import os
+
+from django.core.files.base import ContentFile
+from django.db.models import F
+from PIL import Image
+
+from .cache import bump_version
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (320, 640)
+VARIANTS_DIR = 'recipes/variants'
+WEBP_QUALITY = 80
+
+
+def variant_names(name):
+    """Имена уменьшенных копий картинки в формате WebP по ширине."""
+    base = os.path.splitext(os.path.basename(name))[0]
+    return {
+        width: f'{VARIANTS_DIR}/{base}_{width}.webp'
+        for width in VARIANT_WIDTHS
+    }
+
+
+def generate_variants(storage, name):
+    """Создаёт недостающие уменьшенные копии картинки.
+
+    Возвращает True, если какие-то копии были созданы.
+    """
+    missing = {
+        width: variant for width, variant in variant_names(name).items()
+        if not storage.exists(variant)
+    }
+    if not missing:
+        return False
+    with storage.open(name) as image_file:
+        image = Image.open(image_file)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    for width, variant in missing.items():
+        resized = image.copy()
+        resized.thumbnail((width, width * 4))
+        buffer = io.BytesIO()
+        resized.save(buffer, 'WEBP', quality=WEBP_QUALITY)
+        storage.save(variant, ContentFile(buffer.getvalue()))
+    return True
+
+
+def variants_ready(name):
+    """Отмечает копии картинки готовыми у всех рецептов с ней и
+    сбрасывает кэш их представлений.
+    """
+    recipes = list(Recipe.objects.filter(image=name).exclude(
+        variants_image=name
+    ).values_list('id', flat=True))
+    Recipe.objects.filter(id__in=recipes).update(variants_image=name)
+    for recipe_id in recipes:
+        bump_version(f'recipe:{recipe_id}')
+
+
+def pending_images(limit=None, skip=()):
+    """Картинки рецептов, копии которых ещё не отмечены готовыми."""
+    names = Recipe.objects.exclude(image='').exclude(
+        variants_image=F('image')
+    ).exclude(image__in=skip).order_by().values_list(
+        'image', flat=True
+    ).distinct()
+    return names if limit is None else names[:limit]
+
+
+def process_pending(storage, limit=None, skip=()):
+    """Создаёт копии ожидающих картинок, кроме skip.
+
+    Очередь — сами рецепты: задачи не теряются при перезапуске, а
+    повторная обработка картинки только отмечает готовые копии.
+    Возвращает имена обработанных картинок и тех, что обработать не
+    удалось; последние остаются в очереди.
+    """
+    processed, failed = [], []
+    for name in list(pending_images(limit, skip)):
+        try:
+            generate_variants(storage, name)
+        except Exception:
+            logger.exception('Не удалось создать копии картинки %s', name)
+            failed.append(name)
+            continue
+        variants_ready(name)
+        processed.append(name)
+    return processed, failed
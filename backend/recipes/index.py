@@ -0,0 +1,141 @@
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+
+from django.db import DEFAULT_DB_ALIAS
+
+from .cache import get_version
+from .models import Ingredient, Tag
+
+
+def normalize(value):
+    return value.strip().lower().replace('ё', 'е')
+
+
+def trigrams(value, padded=True):
+    if padded:
+        value = f'  {value} '
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def edit_distance(first, second, limit):
+    """Расстояние Левенштейна; при превышении limit счёт прекращается."""
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (first_char != second_char),
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Совпадения по началу названия ищутся бинарным поиском по
+    отсортированному списку, вхождения и опечатки — по триграммам.
+    """
+
+    def __init__(self, ingredients, version=None):
+        self.version = version
+        self.items = sorted(
+            (
+                {'id': pk, 'name': name, 'measurement_unit': unit}
+                for pk, name, unit in ingredients
+            ),
+            key=lambda item: (normalize(item['name']), item['id']),
+        )
+        self.keys = [normalize(item['name']) for item in self.items]
+        self.trigrams = defaultdict(set)
+        for position, key in enumerate(self.keys):
+            for trigram in trigrams(key):
+                self.trigrams[trigram].add(position)
+
+    def prefix_positions(self, query):
+        start = bisect_left(self.keys, query)
+        end = bisect_left(self.keys, query + '\uffff', lo=start)
+        return range(start, end)
+
+    def substring_positions(self, query):
+        if len(query) < 3:
+            candidates = range(len(self.keys))
+        else:
+            candidates = set.intersection(*(
+                self.trigrams.get(trigram, set())
+                for trigram in trigrams(query, padded=False)
+            ))
+        return sorted(
+            position for position in candidates
+            if query in self.keys[position]
+            and not self.keys[position].startswith(query)
+        )
+
+    def typo_positions(self, query):
+        max_distance = len(query) // 3
+        candidates = set().union(*(
+            self.trigrams.get(trigram, set()) for trigram in trigrams(query)
+        ))
+        ranked = []
+        for position in candidates:
+            key = self.keys[position]
+            distance = edit_distance(query, key[:len(query)], max_distance)
+            if distance <= max_distance:
+                # При равной ошибке в начале названия выше то название,
+                # которое целиком ближе к запросу.
+                ranked.append((
+                    distance,
+                    edit_distance(query, key, len(key)),
+                    position,
+                ))
+        return [position for *_, position in sorted(ranked)]
+
+    def search(self, query):
+        """Ингредиенты по запросу: сначала по началу названия, затем
+        по вхождению, а если ничего не нашлось — с учётом опечаток."""
+        query = normalize(query)
+        if not query:
+            return list(self.items)
+        positions = [
+            *self.prefix_positions(query),
+            *self.substring_positions(query),
+        ]
+        if not positions and len(query) >= 3:
+            positions = self.typo_positions(query)
+        return [self.items[position] for position in positions]
+
+
+# Индексы строятся по основной базе: собранные с отставшей реплики,
+# они остались бы старыми до следующей смены версии.
+@lru_cache(maxsize=1)
+def build_ingredient_index(version):
+    return IngredientIndex(
+        Ingredient.objects.using(DEFAULT_DB_ALIAS).values_list(
+            'id', 'name', 'measurement_unit'
+        ),
+        version,
+    )
+
+
+def get_ingredient_index():
+    """Актуальный индекс ингредиентов, перестраивается по версии."""
+    return build_ingredient_index(get_version('ingredients'))
+
+
+@lru_cache(maxsize=1)
+def build_tag_bits(version):
+    return dict(
+        Tag.objects.using(DEFAULT_DB_ALIAS).exclude(slug=None).values_list(
+            'slug', 'bit'
+        )
+    )
+
+
+def get_tag_bits():
+    """Соответствие slug тэга и его бита в маске рецепта."""
+    return build_tag_bits(get_version('tags'))
@@ -0,0 +1,157 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.db.models.expressions import Col, ResolvedOuterRef
+from django.db.models.lookups import Lookup
+from django.db.models.sql import Query
+from django.db.models.sql.where import WhereNode
+
+from api.exports import shopping_cart_ingredients
+from recipes.models import FeedEntry, Recipe, Tag
+from recipes.search import search_recipes
+from users.models import Follow, User
+
+PAGE_SIZE = 6
+
+SEQ_SCAN = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)()'),
+    'sqlite': re.compile(r'\bSCAN (\w+)( USING .*)?$', re.MULTILINE),
+}
+# Обход индекса без условия: сам по себе его ограничивает LIMIT.
+INDEX_WALK = {
+    'postgresql': re.compile(
+        r'Index (?:Only )?Scan (?:Backward )?using \w+ on (\w+)[^\n]*'
+        r'(?:\n|$)(?!\s*Index Cond)'
+    ),
+    'sqlite': re.compile(r'\bSCAN (\w+) USING (?:COVERING )?INDEX'),
+}
+SQLITE_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+def correlated_filter(node, query=None):
+    """Есть ли в условиях запроса подзапрос со ссылкой на внешнюю строку.
+
+    Такой подзапрос выполняется для каждой просмотренной строки. Ссылка
+    видна как колонка таблицы, которой нет среди таблиц подзапроса.
+    """
+    if isinstance(node, ResolvedOuterRef):
+        return True
+    if isinstance(node, Col):
+        return query is not None and node.alias not in query.alias_map
+    if isinstance(node, Query):
+        return correlated_filter(node.where, node)
+    if isinstance(node, WhereNode):
+        children = node.children
+    elif isinstance(node, Lookup):
+        children = (node.lhs, node.rhs)
+    else:
+        children = getattr(node, 'get_source_expressions', list)()
+    return any(correlated_filter(child, query) for child in children)
+
+
+def full_scans(plan, tables, correlated=False):
+    """Таблицы, которые план читает целиком.
+
+    Обход индекса считается полным чтением, если после него строки
+    сортируются (SQLite) или отбираются подзапросом для каждой строки:
+    тогда LIMIT не ограничивает число прочитанных строк.
+    """
+    vendor = connection.vendor
+    scans = [
+        table for table, using in SEQ_SCAN[vendor].findall(plan)
+        if not using
+    ]
+    if correlated or (vendor == 'sqlite' and SQLITE_SORT in plan):
+        scans += INDEX_WALK[vendor].findall(plan)
+    return [table for table in scans if table in tables]
+
+
+def canonical_queries(user):
+    """Основные запросы API в том виде, в каком их строят вьюхи"""
+    recipes = Recipe.objects.with_related().with_user_flags(user)
+    first = recipes.order_by('-pub_date', '-id').first()
+    authors = Follow.objects.filter(user=user).values_list(
+        'author_id', flat=True
+    )
+    tags_mask = sum(
+        1 << bit for bit in Tag.objects.values_list('bit', flat=True)[:2]
+    )
+    return {
+        'recipes': recipes[:PAGE_SIZE],
+        'recipes_by_author': recipes.filter(author=user)[:PAGE_SIZE],
+        'recipes_by_tags': recipes.with_any_tag(tags_mask)[:PAGE_SIZE],
+        'recipes_favorited': recipes.favorited_by(user)[:PAGE_SIZE],
+        'recipes_in_cart': recipes.in_shopping_cart_of(user)[:PAGE_SIZE],
+        'recipes_search': search_recipes(recipes, first.name)[:PAGE_SIZE],
+        'recipes_cursor': recipes.filter(
+            pub_date__lte=first.pub_date
+        ).exclude(
+            pub_date=first.pub_date, id__gte=first.id
+        ).order_by('-pub_date', '-id')[:PAGE_SIZE],
+        'subscriptions': Follow.objects.filter(
+            user=user
+        ).select_related('author')[:PAGE_SIZE],
+        'latest_for_authors': Recipe.objects.latest_for_authors(
+            list(authors), 3
+        ),
+        'shopping_cart': shopping_cart_ingredients(user),
+        'feed': FeedEntry.objects.filter(user=user).order_by(
+            '-pub_date', '-recipe_id'
+        ).values_list('pub_date', 'recipe_id')[:PAGE_SIZE],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверяет планы основных запросов и падает, '
+        'если какой-то из них читает таблицу целиком'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int,
+            help='id пользователя, от имени которого строятся запросы'
+        )
+
+    def get_user(self, user_id):
+        users = User.objects.annotate(
+            follows=Count('follower')
+        ).order_by('-follows')
+        if user_id is not None:
+            users = users.filter(id=user_id)
+        user = users.first()
+        if user is None or not Recipe.objects.exists():
+            raise CommandError('Нет данных: сначала заполните базу')
+        return user
+
+    def handle(self, *args, **options):
+        if connection.vendor not in SEQ_SCAN:
+            raise CommandError(
+                f'База {connection.vendor} не поддерживается'
+            )
+        user = self.get_user(options['user'])
+        tables = set(connection.introspection.table_names())
+        failed = []
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for name, queryset in canonical_queries(user).items():
+                plan = queryset.explain()
+                scans = full_scans(
+                    plan, tables, correlated_filter(queryset.query)
+                )
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{name}:\n{plan}\n')
+                if scans:
+                    failed.append(f'{name}: {", ".join(scans)}')
+                    self.stdout.write(self.style.ERROR(f'{name}: seq scan'))
+                else:
+                    self.stdout.write(f'{name}: ok')
+        if failed:
+            raise CommandError(
+                'Полное чтение таблиц:\n' + '\n'.join(failed)
+            )
+        self.stdout.write(self.style.SUCCESS('Все запросы идут по индексам'))
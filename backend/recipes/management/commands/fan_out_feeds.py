@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from recipes.models import FeedEntry
+
+
+class Command(BaseCommand):
+    help = (
+        'Возвращает в раздачу лент авторов, у которых подписчиков снова '
+        'не больше FEED_FANOUT_LIMIT. С --watch работает как фоновый '
+        'обработчик'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--watch', action='store_true',
+            help='Не завершаться, а проверять новых авторов'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=60.0,
+            help='Пауза между проверками с --watch, секунды'
+        )
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            authors = FeedEntry.objects.fan_out_pending(
+                options['batch_size']
+            )
+            for author_id in authors:
+                self.stdout.write(f'Ленты заполнены рецептами {author_id}')
+            if len(authors) == options['batch_size']:
+                continue
+            if not options['watch']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Ленты заполнены'))
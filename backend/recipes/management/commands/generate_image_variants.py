@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from recipes.images import process_pending
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт уменьшенные копии картинок рецептов, которые ещё не '
+        'готовы. С --watch работает как фоновый обработчик'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--watch', action='store_true',
+            help='Не завершаться, а проверять новые картинки'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5.0,
+            help='Пауза между проверками с --watch, секунды'
+        )
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field('image').storage
+        # Картинки, которые не удалось обработать, не повторяются до
+        # перезапуска, чтобы не забивать журнал.
+        failed = set()
+        while True:
+            close_old_connections()
+            processed, errors = process_pending(
+                storage, options['batch_size'], failed
+            )
+            failed.update(errors)
+            for name in processed:
+                self.stdout.write(f'Обработано {name}')
+            for name in errors:
+                self.stderr.write(f'Не обработано {name}')
+            if len(processed) + len(errors) == options['batch_size']:
+                continue
+            if not options['watch']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Копии картинок созданы'))
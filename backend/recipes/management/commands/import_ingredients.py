@@ -1,27 +1,128 @@
+import csv
 import json
 import os
+import time
+from itertools import islice
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from recipes import models
+from recipes.cache import bump_version
+from recipes.models import Ingredient
+
+READ_CHUNK_SIZE = 64 * 1024
+FIELDS = ('name', 'measurement_unit')
+
+
+def iter_json(ingredients_file):
+    """Читает массив объектов JSON по одному, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    while True:
+        buffer = buffer[position:].lstrip(' \t\r\n,[')
+        position = 0
+        while True:
+            try:
+                obj, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield obj
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+        chunk = ingredients_file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            if buffer[position:].strip() not in ('', ']'):
+                raise CommandError('Файл JSON повреждён')
+            return
+        buffer += chunk
+
+
+def iter_csv(ingredients_file):
+    for row in csv.reader(ingredients_file):
+        if row:
+            yield dict(zip(FIELDS, row))
+
+
+READERS = {
+    '.json': iter_json,
+    '.csv': iter_csv,
+}
 
 
 class Command(BaseCommand):
+    help = 'Загружает ингредиенты из файла JSON или CSV'
 
-    def handle(self, *args, **options):
-        filepath = os.path.join(
-            settings.BASE_DIR, 'data', 'ingredients.json'
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=os.path.join(
+                settings.BASE_DIR, 'data', 'ingredients.json'
+            ),
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Прочитать файл без записи в базу',
         )
 
-        with open(filepath, encoding='utf-8') as ingredients_file:
-            ingredients = json.load(ingredients_file)
-            for ingredient in ingredients:
-                obj, _ = models.Ingredient.objects.get_or_create(**ingredient)
-                self.stdout.write(f'Loaded "{obj}"')
+    def iter_unique(self, rows):
+        """Ингредиенты без повторов. Записи без названия или единицы
+        измерения пропускаются с сообщением в stderr."""
+        seen = set()
+        for number, row in enumerate(rows, 1):
+            if not (
+                isinstance(row, dict)
+                and all(isinstance(row.get(field), str) for field in FIELDS)
+            ):
+                self.skipped += 1
+                self.stderr.write(f'Пропущена запись {number}: {row!r}')
+                continue
+            key = (row['name'].strip(), row['measurement_unit'].strip())
+            if key[0] and key not in seen:
+                seen.add(key)
+                yield Ingredient(name=key[0], measurement_unit=key[1])
 
-        self.stdout.write(
-            self.style.SUCCESS(
-                'Database has been filled successfully!'
+    def handle(self, *args, **options):
+        path = options['path']
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in READERS:
+            raise CommandError(
+                f'Поддерживаются файлы: {", ".join(READERS)}'
             )
-        )
+        started = time.monotonic()
+        count_before = Ingredient.objects.count()
+        processed = 0
+        self.skipped = 0
+
+        with open(path, encoding='utf-8') as ingredients_file:
+            ingredients = self.iter_unique(
+                READERS[extension](ingredients_file)
+            )
+            while True:
+                batch = list(islice(ingredients, options['batch_size']))
+                if not batch:
+                    break
+                if not options['dry_run']:
+                    Ingredient.objects.bulk_create(
+                        batch, ignore_conflicts=True
+                    )
+                processed += len(batch)
+                self.stdout.write(f'Обработано {processed}')
+
+        elapsed = time.monotonic() - started
+        if self.skipped:
+            self.stderr.write(f'Пропущено записей: {self.skipped}')
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Проверено {processed} ингредиентов за {elapsed:.2f} с'
+            ))
+            return
+        bump_version('ingredients')
+        created = Ingredient.objects.count() - count_before
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено {created} новых из {processed} ингредиентов '
+            f'за {elapsed:.2f} с'
+        ))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from recipes.counters import count_of
+from recipes.models import CartIngredientTotal, FavoriteRecipe, Recipe
+from users.models import Follow, User
+
+COUNTERS = (
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+    (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счётчики рецептов, подписчиков и избранного и итоги '
+        'списков покупок с данными'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не исправлять'
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        for model, counter, source, field in COUNTERS:
+            actual = count_of(source, field)
+            drifted = model.objects.alias(actual=actual).exclude(
+                **{counter: F('actual')}
+            )
+            if options['dry_run']:
+                fixed = drifted.count()
+            else:
+                fixed = drifted.update(**{counter: actual})
+            self.stdout.write(
+                f'{model._meta.model_name}.{counter}: расхождений {fixed}'
+            )
+        stored = CartIngredientTotal.objects.values_list(
+            'user_id', 'ingredient_id', 'total_amount'
+        )
+        actual = CartIngredientTotal.objects.computed()
+        users = {
+            user_id for user_id, _, _ in set(stored) ^ set(actual)
+        }
+        if users and not options['dry_run']:
+            CartIngredientTotal.objects.rebuild(users)
+        self.stdout.write(
+            f'итоги списков покупок: расхождений у {len(users)} '
+            f'пользователей'
+        )
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Счётчики сверены'))
@@ -0,0 +1,255 @@
+import hashlib
+import io
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipes.cache import bump_version
+from recipes.images import generate_variants
+from recipes.models import (CartIngredientTotal, FavoriteRecipe,
+                            FeedEntry, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.search import rebuild_search_index
+from users.models import Follow, User
+
+BENCHMARK_DOMAIN = 'benchmark.local'
+BENCHMARK_PASSWORD = 'benchmark-password'
+BATCH_SIZE = 1000
+
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+DISHES = (
+    'борщ', 'суп', 'салат', 'омлет', 'пирог', 'рагу', 'плов', 'каша',
+    'запеканка', 'котлеты', 'блины', 'паста', 'ризотто', 'щи', 'жаркое',
+)
+ADJECTIVES = (
+    'домашний', 'быстрый', 'летний', 'острый', 'сытный', 'лёгкий',
+    'праздничный', 'постный', 'сливочный', 'деревенский',
+)
+WORDS = (
+    'нарезать', 'обжарить', 'добавить', 'посолить', 'перемешать',
+    'запекать', 'варить', 'подавать', 'зелень', 'масло', 'лук', 'морковь',
+    'чеснок', 'сметана', 'минут', 'огонь', 'духовка', 'сковорода',
+)
+
+
+def placeholder_image(storage):
+    """Одна картинка на все рецепты, сохранённая под хэшем содержимого."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (960, 640), (226, 108, 45)).save(buffer, 'PNG')
+    data = buffer.getvalue()
+    name = f'recipes/{hashlib.sha256(data).hexdigest()}.png'
+    name = storage.save(name, ContentFile(data))
+    generate_variants(storage, name)
+    return name
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими данными для бенчмарков. '
+        'При одинаковых параметрах данные получаются одинаковыми'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--recipes', type=int, default=5000)
+        parser.add_argument('--ingredients', type=int, default=1000)
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, default=8
+        )
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument('--favorites-per-user', type=int, default=30)
+        parser.add_argument('--cart-per-user', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def clear(self):
+        """Удаляет данные прошлого запуска, минуя сигналы по каждой строке.
+
+        Счётчики и поисковый индекс после этого всё равно пересчитываются.
+        """
+        users = User.objects.filter(email__endswith=f'@{BENCHMARK_DOMAIN}')
+        recipes = Recipe.objects.filter(author__in=users)
+        for queryset in (
+            FavoriteRecipe.objects.filter(
+                Q(user__in=users) | Q(recipe__in=recipes)
+            ),
+            ShoppingCart.objects.filter(
+                Q(user__in=users) | Q(recipe__in=recipes)
+            ),
+            CartIngredientTotal.objects.filter(user__in=users),
+            FeedEntry.objects.filter(
+                Q(user__in=users) | Q(recipe__in=recipes)
+            ),
+            Follow.objects.filter(Q(user__in=users) | Q(author__in=users)),
+            IngredientRecipe.objects.filter(recipe__in=recipes),
+            Recipe.tags.through.objects.filter(recipe__in=recipes),
+            recipes,
+            Token.objects.filter(user__in=users),
+            users,
+        ):
+            queryset._raw_delete(queryset.db)
+
+    def create_users(self, count):
+        password = make_password(BENCHMARK_PASSWORD)
+        User.objects.bulk_create(
+            (
+                User(
+                    email=f'bench{i}@{BENCHMARK_DOMAIN}',
+                    username=f'bench{i}',
+                    first_name='Бенчмарк',
+                    last_name=f'Пользователь {i}',
+                    password=password,
+                )
+                for i in range(count)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        return list(User.objects.filter(
+            email__endswith=f'@{BENCHMARK_DOMAIN}'
+        ).order_by('id').values_list('id', flat=True))
+
+    def get_tags(self):
+        for name, color, slug in TAGS:
+            if not Tag.objects.filter(slug=slug).exists():
+                Tag.objects.create(name=name, color=color, slug=slug)
+        return list(Tag.objects.order_by('id').values_list('id', 'bit'))
+
+    def get_ingredients(self, count):
+        missing = count - Ingredient.objects.count()
+        if missing > 0:
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+                    for i in range(missing)
+                ),
+                batch_size=BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+        return list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+
+    def create_recipes(self, rng, count, user_ids, tags, image):
+        recipes = []
+        recipe_tags = []
+        for _ in range(count):
+            chosen = rng.sample(tags, rng.randint(1, len(tags)))
+            recipe_tags.append([tag_id for tag_id, _ in chosen])
+            name = f'{rng.choice(ADJECTIVES)} {rng.choice(DISHES)}'
+            recipes.append(Recipe(
+                author_id=rng.choice(user_ids),
+                name=name.capitalize(),
+                text=' '.join(rng.choices(WORDS, k=rng.randint(20, 80))),
+                image=image,
+                variants_image=image,
+                cooking_time=rng.randint(5, 180),
+                tags_mask=sum(1 << bit for _, bit in chosen),
+            ))
+        first_id = Recipe.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+        Recipe.objects.bulk_create(recipes, batch_size=BATCH_SIZE)
+        recipe_ids = list(Recipe.objects.filter(
+            id__gt=first_id, author_id__in=user_ids
+        ).order_by('id').values_list('id', flat=True))
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id, tag_ids in zip(recipe_ids, recipe_tags)
+                for tag_id in tag_ids
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        return recipe_ids
+
+    def create_links(self, rng, options, user_ids, recipe_ids,
+                     ingredient_ids):
+        per_recipe = min(
+            options['ingredients_per_recipe'], len(ingredient_ids)
+        )
+        IngredientRecipe.objects.bulk_create(
+            (
+                IngredientRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=rng.randint(1, 500),
+                )
+                for recipe_id in recipe_ids
+                for ingredient_id in rng.sample(ingredient_ids, per_recipe)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        # Популярность авторов убывает по закону Ципфа.
+        weights = [1 / (rank + 1) for rank in range(len(user_ids))]
+        follows = set()
+        for user_id in user_ids:
+            authors = rng.choices(
+                user_ids, weights, k=options['follows_per_user']
+            )
+            follows.update(
+                (user_id, author_id) for author_id in authors
+                if author_id != user_id
+            )
+        Follow.objects.bulk_create(
+            (
+                Follow(user_id=user_id, author_id=author_id)
+                for user_id, author_id in sorted(follows)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        for model, key in (
+            (FavoriteRecipe, 'favorites_per_user'),
+            (ShoppingCart, 'cart_per_user'),
+        ):
+            per_user = min(options[key], len(recipe_ids))
+            model.objects.bulk_create(
+                (
+                    model(user_id=user_id, recipe_id=recipe_id)
+                    for user_id in user_ids
+                    for recipe_id in rng.sample(recipe_ids, per_user)
+                ),
+                batch_size=BATCH_SIZE,
+            )
+        return len(follows)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rng = random.Random(options['seed'])
+        storage = Recipe._meta.get_field('image').storage
+        image = placeholder_image(storage)
+        with transaction.atomic():
+            self.clear()
+            user_ids = self.create_users(options['users'])
+            tags = self.get_tags()
+            ingredient_ids = self.get_ingredients(options['ingredients'])
+            recipe_ids = self.create_recipes(
+                rng, options['recipes'], user_ids, tags, image
+            )
+            follows = self.create_links(
+                rng, options, user_ids, recipe_ids, ingredient_ids
+            )
+            rebuild_search_index()
+            CartIngredientTotal.objects.rebuild()
+            call_command('reconcile_counters', stdout=io.StringIO())
+            FeedEntry.objects.rebuild()
+        for name in ('ingredients', 'tags'):
+            bump_version(name)
+        for user_id in user_ids:
+            bump_version(f'shopping_cart:{user_id}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(user_ids)}, '
+            f'рецептов: {len(recipe_ids)}, подписок: {follows} '
+            f'за {time.monotonic() - started:.1f} с. '
+            f'Пароль пользователей: {BENCHMARK_PASSWORD}'
+        ))
@@ -0,0 +1,51 @@
+# Generated by Django 3.2 on 2026-10-18 03:33
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(kept_id=Min('id'), total=Count('id')).filter(total__gt=1)
+    for duplicate in duplicates:
+        kept_id = duplicate['kept_id']
+        extra_ids = Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit'],
+        ).exclude(id=kept_id).values_list('id', flat=True)
+        recipes_with_kept = IngredientRecipe.objects.filter(
+            ingredient_id=kept_id
+        ).values_list('recipe_id', flat=True)
+        for extra_id in extra_ids:
+            links = IngredientRecipe.objects.filter(ingredient_id=extra_id)
+            links.filter(recipe_id__in=recipes_with_kept).delete()
+            links.update(ingredient_id=kept_id)
+        Ingredient.objects.filter(id__in=extra_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_auto_20230205_2309'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='ingredientrecipe',
+            name='unique_ingredients_recipes',
+        ),
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientrecipe',
+            constraint=models.UniqueConstraint(fields=('ingredient', 'recipe'), name='unique_ingredient_recipes'),
+        ),
+    ]
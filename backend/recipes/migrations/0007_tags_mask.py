@@ -0,0 +1,49 @@
+# Generated by Django 3.2 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+def fill_tags_mask(apps, schema_editor):
+    Tag = apps.get_model('recipes', 'Tag')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    tags = list(Tag.objects.order_by('id'))
+    if len(tags) > 63:
+        raise RuntimeError('Тэгов не может быть больше 63')
+    for bit, tag in enumerate(tags):
+        tag.bit = bit
+    Tag.objects.bulk_update(tags, ['bit'])
+    masks = {}
+    links = Recipe.tags.through.objects.values_list('recipe_id', 'tag__bit')
+    for recipe_id, bit in links.iterator():
+        masks[recipe_id] = masks.get(recipe_id, 0) | 1 << bit
+    Recipe.objects.bulk_update(
+        [Recipe(id=pk, tags_mask=mask) for pk, mask in masks.items()],
+        ['tags_mask'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, verbose_name='Бит в маске тэгов'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Маска тэгов'),
+        ),
+        migrations.RunPython(fill_tags_mask, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, unique=True, verbose_name='Бит в маске тэгов'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.2 on 2026-10-18 03:45
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Follow = apps.get_model('users', 'Follow')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    FavoriteRecipe = apps.get_model('recipes', 'FavoriteRecipe')
+    User.objects.update(
+        recipes_count=count_of(Recipe, 'author'),
+        followers_count=count_of(Follow, 'author'),
+    )
+    Recipe.objects.update(favorites_count=count_of(FavoriteRecipe, 'recipe'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_tags_mask'),
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.2 on 2026-10-18 03:46
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "UPDATE recipes_recipe SET search_vector = "
+            "setweight(to_tsvector('russian', name), 'A') || "
+            "setweight(to_tsvector('russian', text), 'B')"
+        )
+        schema_editor.execute(
+            'CREATE INDEX recipe_search_idx ON recipes_recipe '
+            'USING gin (search_vector)'
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5('
+            "name, text, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            'INSERT INTO recipes_recipe_fts (rowid, name, text) '
+            'SELECT id, name, text FROM recipes_recipe'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX recipe_search_idx')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE recipes_recipe_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.2 on 2026-10-18 04:02
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_cart_totals(apps, schema_editor):
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    CartIngredientTotal = apps.get_model('recipes', 'CartIngredientTotal')
+    totals = IngredientRecipe.objects.filter(
+        recipe__recipe_cart__isnull=False
+    ).values('recipe__recipe_cart__user_id', 'ingredient_id').annotate(
+        total_amount=Sum('amount')
+    ).order_by()
+    CartIngredientTotal.objects.bulk_create(
+        (
+            CartIngredientTotal(
+                user_id=row['recipe__recipe_cart__user_id'],
+                ingredient_id=row['ingredient_id'],
+                total_amount=row['total_amount'],
+            )
+            for row in totals.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0009_recipe_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartIngredientTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.IntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_totals', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_totals', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Итог списка покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='cartingredienttotal',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_cart_total'),
+        ),
+        migrations.RunPython(fill_cart_totals, migrations.RunPython.noop),
+    ]
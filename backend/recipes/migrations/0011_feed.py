@@ -0,0 +1,71 @@
+# Generated by Django 3.2 on 2026-10-18 04:06
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+FEED_BACKFILL = 50
+
+
+def fill_feed(apps, schema_editor):
+    Follow = apps.get_model('users', 'Follow')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    FeedEntry = apps.get_model('recipes', 'FeedEntry')
+    followers = defaultdict(list)
+    follows = Follow.objects.filter(
+        author__followers_count__lte=settings.FEED_FANOUT_LIMIT
+    ).values_list('author_id', 'user_id')
+    for author_id, user_id in follows.iterator():
+        followers[author_id].append(user_id)
+    for author_id, user_ids in followers.items():
+        recipes = Recipe.objects.filter(author_id=author_id).order_by(
+            '-pub_date', '-id'
+        ).values_list('id', 'pub_date')[:FEED_BACKFILL]
+        FeedEntry.objects.bulk_create(
+            (
+                FeedEntry(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    author_id=author_id,
+                    pub_date=pub_date,
+                )
+                for recipe_id, pub_date in recipes
+                for user_id in user_ids
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0010_cart_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='feed_user_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feedentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_feed_entry'),
+        ),
+        migrations.RunPython(fill_feed, migrations.RunPython.noop),
+    ]
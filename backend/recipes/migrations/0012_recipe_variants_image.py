@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 04:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='variants_image',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100, verbose_name='Картинка с готовыми копиями'),
+        ),
+    ]
@@ -1,8 +1,32 @@
+from collections import defaultdict
+
 from colorfield.fields import ColorField
+from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models.expressions import RawSQL, Window
+from django.db.models.functions import RowNumber
+from django.dispatch import Signal
+
+from users.models import CountersMixin, Follow, User, UserLinkQuerySet
+from .storage import ContentAddressedStorage
+
+# Знаковый бит BigIntegerField под тэги не используется.
+TAG_BITS = 63
+# Сколько последних рецептов автора попадает в ленту при подписке.
+FEED_BACKFILL = 50
 
-from users.models import User
+# Избранное или список покупок пользователя изменены массово, без
+# сигналов по каждой строке. Аргументы: user_id, action ('add' или
+# 'remove') и recipe_ids — id действительно добавленных или убранных
+# рецептов.
+user_recipes_changed = Signal()
+# Ингредиенты рецептов добавлены, убраны или изменено их количество.
+# Отправляется тем, кто их меняет, один раз на изменение, а не по каждой
+# строке. Аргумент recipe_ids.
+recipe_ingredients_changed = Signal()
 
 
 class Ingredient(models.Model):
@@ -19,6 +43,12 @@ class Ingredient(models.Model):
 
     class Meta:
         verbose_name = 'Ингредиент'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return f'{self.name} ({self.measurement_unit})'
@@ -44,6 +74,11 @@ class Tag(models.Model):
         max_length=256,
         verbose_name='Slug тэга'
     )
+    bit = models.PositiveSmallIntegerField(
+        unique=True,
+        editable=False,
+        verbose_name='Бит в маске тэгов'
+    )
 
     class Meta:
         verbose_name = 'Тэг'
@@ -51,8 +86,162 @@ class Tag(models.Model):
     def __str__(self):
         return f'{self.name} {self.id}'
 
+    def save(self, *args, **kwargs):
+        if self.bit is not None:
+            super().save(*args, **kwargs)
+            return
+        using = kwargs.get('using') or router.db_for_write(
+            type(self), instance=self
+        )
+        # Свободный бит ищется и занимается под блокировкой таблицы:
+        # иначе два новых тэга получили бы один бит.
+        with transaction.atomic(using=using):
+            self.lock_table(using)
+            self.bit = self.free_bit(using)
+            try:
+                super().save(*args, **kwargs)
+            except Exception:
+                self.bit = None
+                raise
 
-class Recipe(models.Model):
+    @classmethod
+    def lock_table(cls, using):
+        """Блокирует добавление тэгов до конца транзакции.
+
+        На других базах повторный бит отвергнет уникальность поля.
+        """
+        connection = connections[using]
+        if connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE'.format(
+                    connection.ops.quote_name(cls._meta.db_table)
+                )
+            )
+
+    @classmethod
+    def free_bit(cls, using=None):
+        used = set(cls.objects.using(using).values_list('bit', flat=True))
+        for bit in range(TAG_BITS):
+            if bit not in used:
+                return bit
+        raise ValidationError(f'Тэгов не может быть больше {TAG_BITS}')
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Запросы к рецептам."""
+
+    def with_related(self):
+        """Подгружает связи, которые нужны для вывода рецепта.
+
+        Автор выбирается тем же запросом, тэги и ингредиенты — по одному
+        запросу на всю выборку, независимо от числа рецептов.
+        """
+        return self.select_related('author').prefetch_related(
+            models.Prefetch('tags', queryset=Tag.objects.order_by('id')),
+            models.Prefetch(
+                'resipe_ingredient',
+                queryset=IngredientRecipe.objects.select_related(
+                    'ingredient'
+                ).order_by('id'),
+            ),
+        )
+
+    def latest_for_authors(self, author_ids, limit=None):
+        """Последние рецепты авторов, не больше limit у каждого.
+
+        Ограничение применяется в базе оконной функцией, поэтому рецепты
+        всех авторов выбираются одним запросом.
+        """
+        recipes = self.filter(author_id__in=author_ids)
+        # Пустой список авторов не собрать в SQL окна.
+        if limit is None or not author_ids:
+            return recipes
+        ranked = recipes.order_by().annotate(
+            recipe_rank=Window(
+                expression=RowNumber(),
+                partition_by=models.F('author_id'),
+                order_by=(
+                    models.F('pub_date').desc(), models.F('id').desc()
+                ),
+            )
+        ).values('id', 'recipe_rank')
+        sql, params = ranked.query.sql_with_params()
+        return recipes.filter(id__in=RawSQL(
+            f'SELECT "id" FROM ({sql}) AS ranked WHERE "recipe_rank" <= %s',
+            (*params, limit),
+        ))
+
+    def with_any_tag(self, mask):
+        """Рецепты, у которых есть хотя бы один тэг из маски.
+
+        Условие на маску индексом не ищется: страница рецептов выбирается
+        обходом индекса по дате публикации, который останавливается на
+        LIMIT. Тэгов мало, и у каждого много рецептов, поэтому обход
+        короткий; редкий тэг читает больше строк. План проверяет
+        check_query_plans (recipes_by_tags).
+        """
+        return self.alias(
+            tags_match=models.F('tags_mask').bitand(mask)
+        ).filter(tags_match__gt=0)
+
+    def refresh_tags_mask(self):
+        """Пересчитывает маску тэгов по связям рецептов с тэгами."""
+        masks = dict.fromkeys(self.values_list('id', flat=True), 0)
+        links = Recipe.tags.through.objects.filter(
+            recipe_id__in=masks
+        ).values_list('recipe_id', 'tag__bit')
+        for recipe_id, bit in links:
+            masks[recipe_id] |= 1 << bit
+        Recipe.objects.bulk_update(
+            [Recipe(id=pk, tags_mask=mask) for pk, mask in masks.items()],
+            ['tags_mask'],
+        )
+        return masks
+
+    def favorited_by(self, user):
+        """Рецепты из избранного пользователя.
+
+        Выборка идёт от избранного пользователя, а не проверкой каждого
+        рецепта подзапросом.
+        """
+        return self.filter(id__in=FavoriteRecipe.objects.filter(
+            user=user
+        ).values('recipe_id'))
+
+    def in_shopping_cart_of(self, user):
+        """Рецепты из списка покупок пользователя."""
+        return self.filter(id__in=ShoppingCart.objects.filter(
+            user=user
+        ).values('recipe_id'))
+
+    def with_user_flags(self, user):
+        """Добавляет флаги «в избранном» и «в списке покупок»."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(
+                FavoriteRecipe.objects.filter(
+                    user=user, recipe=models.OuterRef('pk')
+                )
+            ),
+            is_in_shopping_cart=models.Exists(
+                ShoppingCart.objects.filter(
+                    user=user, recipe=models.OuterRef('pk')
+                )
+            ),
+        )
+
+
+class Recipe(CountersMixin, models.Model):
     """Модель для рецептов."""
 
     author = models.ForeignKey(
@@ -67,6 +256,7 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='recipes/',
+        storage=ContentAddressedStorage(),
         verbose_name='Изображение'
     )
     text = models.TextField(
@@ -83,23 +273,93 @@ class Recipe(models.Model):
         related_name='tags',
         verbose_name='Тэг'
     )
+    variants_image = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name='Картинка с готовыми копиями'
+    )
+    tags_mask = models.BigIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Маска тэгов'
+    )
     pub_date = models.DateTimeField(
         auto_now_add=True,
         verbose_name='Дата публикации'
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор'
+    )
     cooking_time = models.IntegerField(
         verbose_name='Время приготовления, мин',
         default=0,
         validators=[MinValueValidator(1, 'Время должно быть > 1мин.')]
     )
 
+    objects = RecipeQuerySet.as_manager()
+
+    counter_fields = ('favorites_count', 'tags_mask', 'variants_image')
+
     class Meta:
         verbose_name = 'Рецепт'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.name}, {self.author}'
 
+    @property
+    def variants_ready(self):
+        """Уменьшенные копии текущей картинки уже созданы."""
+        return bool(self.image) and self.variants_image == self.image.name
+
+
+class UserRecipeQuerySet(UserLinkQuerySet):
+    """Запросы к избранному и списку покупок пользователя."""
+
+    link_field = 'recipe'
+
+    def add(self, user, recipe_ids):
+        """Добавляет рецепты одним INSERT, уже добавленные пропускаются.
+
+        Рецепты должны существовать.
+        """
+        with transaction.atomic(using=self.db):
+            added = self.insert_links(user.id, recipe_ids)
+            if added:
+                user_recipes_changed.send(
+                    self.model, user_id=user.id, action='add',
+                    recipe_ids=added
+                )
+
+    def remove(self, user, recipe_ids):
+        """Убирает рецепты одним DELETE, отсутствующие пропускаются."""
+        with transaction.atomic(using=self.db):
+            removed = self.delete_links(user.id, recipe_ids)
+            if removed:
+                user_recipes_changed.send(
+                    self.model, user_id=user.id, action='remove',
+                    recipe_ids=removed
+                )
+
 
 class FavoriteRecipe(models.Model):
     user = models.ForeignKey(
@@ -113,6 +373,8 @@ class FavoriteRecipe(models.Model):
         related_name='favorite_recipe',
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Избранные рецепты'
         constraints = [
@@ -174,6 +436,8 @@ class ShoppingCart(models.Model):
         verbose_name='Рецепт'
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Список покупок'
         constraints = (
@@ -185,3 +449,316 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user} добавил в избанное {self.recipe}'
+
+
+class CartTotalQuerySet(models.QuerySet):
+    """Запросы к итогам списков покупок."""
+
+    def change(self, user_id, recipe_ids, sign):
+        """Прибавляет (sign=1) или вычитает (sign=-1) ингредиенты рецептов
+        из итогов списка покупок пользователя.
+
+        На PostgreSQL и SQLite это один INSERT ... ON CONFLICT, на
+        остальных базах итоги пользователя пересчитываются целиком.
+        """
+        connection = connections[self.db]
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            self.rebuild([user_id])
+            return
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        links = connection.ops.quote_name(IngredientRecipe._meta.db_table)
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} '
+                f'("user_id", "ingredient_id", "total_amount") '
+                f'SELECT %s, "ingredient_id", %s * SUM("amount") '
+                f'FROM {links} WHERE "recipe_id" IN ({placeholders}) '
+                f'GROUP BY "ingredient_id" '
+                f'ON CONFLICT ("user_id", "ingredient_id") DO UPDATE '
+                f'SET "total_amount" = {table}."total_amount" '
+                f'+ EXCLUDED."total_amount"',
+                (user_id, sign, *recipe_ids),
+            )
+        if sign < 0:
+            self.filter(user_id=user_id, total_amount__lte=0).delete()
+
+    def computed(self, user_ids=None):
+        """Итоги, посчитанные заново по спискам покупок: строки
+        (user_id, ingredient_id, total_amount).
+        """
+        # Условие на список покупок задаётся одним filter: второй
+        # добавил бы ещё одно соединение и умножил суммы на число
+        # списков с рецептом.
+        if user_ids is None:
+            links = IngredientRecipe.objects.filter(
+                recipe__recipe_cart__isnull=False
+            )
+        else:
+            links = IngredientRecipe.objects.filter(
+                recipe__recipe_cart__user_id__in=user_ids
+            )
+        return links.values_list(
+            'recipe__recipe_cart__user_id', 'ingredient_id'
+        ).annotate(total_amount=models.Sum('amount')).order_by()
+
+    def rebuild(self, user_ids=None):
+        """Пересчитывает итоги пользователей по их спискам покупок.
+
+        Без user_ids пересчитываются итоги всех пользователей.
+        """
+        totals = self.all()
+        if user_ids is not None:
+            totals = totals.filter(user_id__in=user_ids)
+        totals.delete()
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    total_amount=total_amount,
+                )
+                for user_id, ingredient_id, total_amount in self.computed(
+                    user_ids
+                ).iterator()
+            ),
+            batch_size=1000,
+        )
+
+
+class CartIngredientTotal(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя.
+
+    Поддерживается сигналами при изменении списка покупок и ингредиентов
+    рецептов в нём.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='cart_totals',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='cart_totals',
+        verbose_name='Ингредиент'
+    )
+    total_amount = models.IntegerField(
+        verbose_name='Количество'
+    )
+
+    objects = CartTotalQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Итог списка покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_total',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} - {self.total_amount}'
+
+
+def after_cursor(queryset, cursor, id_field='id'):
+    """Рецепты после курсора (pub_date, id) при сортировке по убыванию."""
+    if cursor is None:
+        return queryset
+    pub_date, pk = cursor
+    return queryset.filter(
+        models.Q(pub_date__lt=pub_date)
+        | models.Q(pub_date=pub_date, **{f'{id_field}__lt': pk})
+    )
+
+
+class FeedQuerySet(models.QuerySet):
+    """Ленты подписок.
+
+    Новый рецепт сразу раздаётся в ленты подписчиков автора. Как только
+    у автора становится больше FEED_FANOUT_LIMIT подписчиков, его рецепты
+    перестают раздаваться (User.feed_fanout) и подмешиваются при чтении
+    ленты. Обратно в раздачу автор возвращается фоновой командой
+    fan_out_feeds: заполнять ленты всех его подписчиков в запросе того,
+    кто отписался, слишком долго.
+    """
+
+    def backfill(self, user_ids, author_ids):
+        """Добавляет в ленты пользователей последние рецепты авторов."""
+        recipes = Recipe.objects.latest_for_authors(
+            author_ids, FEED_BACKFILL
+        ).values_list('id', 'author_id', 'pub_date')
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    author_id=author_id,
+                    pub_date=pub_date,
+                )
+                for recipe_id, author_id, pub_date in recipes
+                for user_id in user_ids
+            ),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    def fan_out(self, recipe):
+        """Раздаёт новый рецепт в ленты подписчиков автора."""
+        followers = Follow.objects.filter(
+            author_id=recipe.author_id, author__feed_fanout=True,
+        ).values_list('user_id', flat=True)
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id,
+                    recipe_id=recipe.id,
+                    author_id=recipe.author_id,
+                    pub_date=recipe.pub_date,
+                )
+                for user_id in followers.iterator()
+            ),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    def followed(self, user_id, author_ids):
+        """Добавляет в ленту пользователя рецепты новых подписок.
+
+        Авторы, у которых подписчиков стало больше FEED_FANOUT_LIMIT,
+        выводятся из раздачи.
+        """
+        User.objects.filter(
+            pk__in=author_ids,
+            feed_fanout=True,
+            followers_count__gt=settings.FEED_FANOUT_LIMIT,
+        ).update(feed_fanout=False)
+        authors = list(User.objects.filter(
+            pk__in=author_ids, feed_fanout=True,
+        ).values_list('id', flat=True))
+        if authors:
+            self.backfill([user_id], authors)
+
+    def unfollowed(self, user_id, author_ids):
+        """Убирает из ленты пользователя рецепты отменённых подписок."""
+        self.filter(user_id=user_id, author_id__in=author_ids).delete()
+
+    def fan_out_pending(self, limit=None):
+        """Возвращает в раздачу авторов, у которых подписчиков снова не
+        больше FEED_FANOUT_LIMIT, и заполняет ленты их подписчиков.
+
+        Пока транзакция по автору не завершена, его рецепты подмешиваются
+        при чтении, поэтому ленты не теряют записей. Возвращает id
+        обработанных авторов.
+        """
+        authors = list(User.objects.filter(
+            feed_fanout=False,
+            followers_count__lte=settings.FEED_FANOUT_LIMIT,
+        ).order_by('id').values_list('id', flat=True)[:limit])
+        for author_id in authors:
+            with transaction.atomic():
+                # UPDATE блокирует строку автора до конца транзакции:
+                # подписки и новые рецепты, меняющие его счётчики, ждут
+                # заполнения лент.
+                changed = User.objects.filter(
+                    pk=author_id,
+                    feed_fanout=False,
+                    followers_count__lte=settings.FEED_FANOUT_LIMIT,
+                ).update(feed_fanout=True)
+                if changed:
+                    self.backfill(
+                        list(Follow.objects.filter(
+                            author_id=author_id
+                        ).values_list('user_id', flat=True)),
+                        [author_id],
+                    )
+        return authors
+
+    def rebuild(self):
+        """Собирает все ленты заново по подпискам."""
+        self.all().delete()
+        User.objects.update(feed_fanout=models.Case(
+            models.When(
+                followers_count__gt=settings.FEED_FANOUT_LIMIT,
+                then=models.Value(False),
+            ),
+            default=models.Value(True),
+        ))
+        followers = defaultdict(list)
+        follows = Follow.objects.filter(
+            author__feed_fanout=True
+        ).values_list('author_id', 'user_id')
+        for author_id, user_id in follows.iterator():
+            followers[author_id].append(user_id)
+        for author_id, user_ids in followers.items():
+            self.backfill(user_ids, [author_id])
+
+    def page(self, user, cursor, size):
+        """Ключи (pub_date, id) первых size рецептов ленты после курсора.
+
+        Обе выборки — диапазоны по индексам ленты и рецептов автора.
+        """
+        entries = after_cursor(
+            self.filter(user=user), cursor, 'recipe_id'
+        ).order_by('-pub_date', '-recipe_id').values_list(
+            'pub_date', 'recipe_id'
+        )
+        keys = set(entries[:size])
+        authors = list(Follow.objects.filter(
+            user=user, author__feed_fanout=False
+        ).values_list('author_id', flat=True))
+        if authors:
+            recipes = after_cursor(
+                Recipe.objects.filter(author_id__in=authors), cursor
+            ).order_by('-pub_date', '-id').values_list('pub_date', 'id')
+            keys.update(recipes[:size])
+        return sorted(keys, reverse=True)[:size]
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписок пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации'
+    )
+
+    objects = FeedQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry',
+            ),
+        )
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_user_pub_date_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.recipe}'
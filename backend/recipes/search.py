@@ -0,0 +1,101 @@
+import re
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+# Название весит больше описания: веса bm25 по столбцам name, text.
+FTS_WEIGHTS = (10.0, 1.0)
+
+TOKEN = re.compile(r'\w+')
+
+
+def search_vector():
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_index(recipe):
+    """Обновляет поисковый индекс после сохранения рецепта."""
+    if connection.vendor == 'postgresql':
+        Recipe.objects.filter(pk=recipe.pk).update(
+            search_vector=search_vector()
+        )
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', (recipe.pk,)
+            )
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+                f'VALUES (%s, %s, %s)',
+                (recipe.pk, recipe.name, recipe.text),
+            )
+
+
+def delete_search_index(recipe):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', (recipe.pk,)
+            )
+
+
+def rebuild_search_index():
+    """Строит поисковый индекс заново, например после bulk_create."""
+    if connection.vendor == 'postgresql':
+        Recipe.objects.update(search_vector=search_vector())
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+                f'SELECT id, name, text FROM recipes_recipe'
+            )
+
+
+def fts_match(value):
+    """Запрос FTS5 из слов поиска: каждое слово ищется как префикс."""
+    return ' '.join(f'"{token}"*' for token in TOKEN.findall(value))
+
+
+def search_recipes(queryset, value):
+    """Рецепты, подходящие под поиск, от самых релевантных.
+
+    В PostgreSQL используется tsvector с GIN-индексом, в SQLite —
+    таблица FTS5. Остальные базы ищут подстроку без ранжирования.
+    """
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(
+            value, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        queryset = queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        )
+    elif connection.vendor == 'sqlite':
+        match = fts_match(value)
+        if not match:
+            return queryset.none()
+        weights = ', '.join(map(str, FTS_WEIGHTS))
+        queryset = queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (match,),
+        )).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s '
+            f'AND rowid = "recipes_recipe"."id"',
+            (match,),
+        ))
+    else:
+        return queryset.filter(
+            Q(name__icontains=value) | Q(text__icontains=value)
+        )
+    return queryset.order_by('-search_rank', '-pub_date', '-id')
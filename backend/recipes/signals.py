@@ -0,0 +1,150 @@
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from users.models import User
+from .cache import bump_version_on_commit
+from .search import delete_search_index, update_search_index
+from .models import (CartIngredientTotal, FavoriteRecipe, FeedEntry,
+                     Ingredient, IngredientRecipe, Recipe, ShoppingCart,
+                     Tag, recipe_ingredients_changed, user_recipes_changed)
+
+
+def bump_recipe_version(recipe_id):
+    """Сбрасывает кэш представления рецепта после коммита."""
+    bump_version_on_commit(f'recipe:{recipe_id}')
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredients_changed(**kwargs):
+    bump_version_on_commit('ingredients')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tags_changed(**kwargs):
+    bump_version_on_commit('tags')
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(instance, **kwargs):
+    Recipe.objects.with_any_tag(1 << instance.bit).update(
+        tags_mask=F('tags_mask').bitand(~(1 << instance.bit))
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        masks = Recipe.objects.filter(pk=instance.pk).refresh_tags_mask()
+        instance.tags_mask = masks.get(instance.pk, 0)
+        bump_recipe_version(instance.pk)
+    elif action == 'post_clear':
+        tag_deleted(instance)
+    else:
+        Recipe.objects.filter(pk__in=pk_set).refresh_tags_mask()
+        for recipe_id in pk_set:
+            bump_recipe_version(recipe_id)
+
+
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def shopping_cart_changed(instance, **kwargs):
+    bump_version_on_commit(f'shopping_cart:{instance.user_id}')
+
+
+@receiver(post_save, sender=ShoppingCart)
+def shopping_cart_created(instance, created, **kwargs):
+    if created:
+        CartIngredientTotal.objects.change(
+            instance.user_id, [instance.recipe_id], 1
+        )
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def shopping_cart_deleting(instance, **kwargs):
+    # До удаления: при удалении рецепта его ингредиенты ещё на месте.
+    CartIngredientTotal.objects.change(
+        instance.user_id, [instance.recipe_id], -1
+    )
+
+
+@receiver(user_recipes_changed, sender=ShoppingCart)
+def shopping_cart_bulk_changed(user_id, action, recipe_ids, **kwargs):
+    CartIngredientTotal.objects.change(
+        user_id, recipe_ids, 1 if action == 'add' else -1
+    )
+    bump_version_on_commit(f'shopping_cart:{user_id}')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_representation_changed(instance, **kwargs):
+    bump_recipe_version(instance.pk)
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def recipe_ingredient_changed(instance, **kwargs):
+    bump_recipe_version(instance.recipe_id)
+
+
+@receiver(recipe_ingredients_changed, sender=IngredientRecipe)
+def recipe_ingredients_bulk_changed(recipe_ids, **kwargs):
+    for recipe_id in recipe_ids:
+        bump_recipe_version(recipe_id)
+    users = set(ShoppingCart.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('user_id', flat=True))
+    if users:
+        CartIngredientTotal.objects.rebuild(users)
+    for user_id in users:
+        bump_version_on_commit(f'shopping_cart:{user_id}')
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_text_saved(instance, update_fields, **kwargs):
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        update_search_index(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_text_deleted(instance, **kwargs):
+    delete_search_index(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1
+        )
+        FeedEntry.objects.fan_out(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).update(
+        recipes_count=F('recipes_count') - 1
+    )
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+def favorite_created(instance, created, **kwargs):
+    if created:
+        Recipe.objects.filter(pk=instance.recipe_id).update(
+            favorites_count=F('favorites_count') + 1
+        )
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+def favorite_deleted(instance, **kwargs):
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        favorites_count=F('favorites_count') - 1
+    )
+
+
+@receiver(user_recipes_changed, sender=FavoriteRecipe)
+def favorites_bulk_changed(action, recipe_ids, **kwargs):
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        favorites_count=F('favorites_count') + (1 if action == 'add' else -1)
+    )
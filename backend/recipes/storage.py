@@ -0,0 +1,40 @@
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+HASH_NAME = re.compile(r'[0-9a-f]{64}')
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_content_addressed(name, content):
+    """Имя файла — sha256 его содержимого."""
+    base = os.path.splitext(os.path.basename(name))[0]
+    return bool(HASH_NAME.fullmatch(base)) and base == content_hash(content)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором файлы с именем-хэшем содержимого не копируются.
+
+    Файл, имя которого — sha256 содержимого, при повторной загрузке не
+    записывается: сохранённый файл с тем же именем и есть он. Остальные
+    имена, например загруженные через админку, получают уникальный
+    суффикс, как в обычном хранилище.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        if self.exists(name) and is_content_addressed(name, content):
+            return name
+        return super().save(name, content, max_length)
@@ -0,0 +1,409 @@
+import hashlib
+import io
+import json
+import tempfile
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.core.cache import cache
+from django.db.models import F
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from users.models import User
+from .models import (CartIngredientTotal, FavoriteRecipe, Ingredient,
+                     IngredientRecipe, Recipe, ShoppingCart, Tag,
+                     user_recipes_changed)
+from .images import pending_images, process_pending, variant_names
+from .index import (IngredientIndex, build_ingredient_index,
+                    get_ingredient_index)
+from .storage import ContentAddressedStorage
+from api.serializers import RecipePostSerializer
+from users.serializers import ShortRecipeSerializer
+
+
+class CartTotalsTests(TestCase):
+    """Итоги списков покупок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов', password='pass12345!'
+        )
+        cls.users = [
+            User.objects.create_user(
+                email=f'user{number}@example.com', username=f'user{number}',
+                first_name='Имя', last_name='Фамилия', password='pass12345!'
+            )
+            for number in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ing{number}',
+                                      measurement_unit='г')
+            for number in range(2)
+        ]
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', image='recipes/x.png',
+            text='Текст', cooking_time=5
+        )
+        for ingredient, amount in zip(cls.ingredients, (10, 5)):
+            IngredientRecipe.objects.create(
+                recipe=cls.recipe, ingredient=ingredient, amount=amount
+            )
+
+    def totals(self, user):
+        return dict(CartIngredientTotal.objects.filter(user=user).values_list(
+            'ingredient__name', 'total_amount'
+        ))
+
+    def test_recipe_in_two_carts(self):
+        for user in self.users:
+            ShoppingCart.objects.create(user=user, recipe=self.recipe)
+        for user in self.users:
+            self.assertEqual(self.totals(user), {'ing0': 10, 'ing1': 5})
+
+        serializer = RecipePostSerializer(self.recipe, partial=True, data={
+            'ingredients': [
+                {'id': self.ingredients[0].id, 'amount': 11},
+                {'id': self.ingredients[1].id, 'amount': 5},
+            ],
+        })
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        for user in self.users:
+            self.assertEqual(self.totals(user), {'ing0': 11, 'ing1': 5})
+        self.assertCountEqual(
+            CartIngredientTotal.objects.computed(),
+            CartIngredientTotal.objects.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            ),
+        )
+
+    def test_admin_change(self):
+        ShoppingCart.objects.create(user=self.users[0], recipe=self.recipe)
+        admin = User.objects.create_superuser(
+            email='admin@example.com', username='admin',
+            first_name='Админ', last_name='Админов', password='pass12345!'
+        )
+        self.client.force_login(admin)
+        link = IngredientRecipe.objects.get(ingredient=self.ingredients[0])
+        url = f'/admin/recipes/ingredientrecipe/{link.id}/'
+        response = self.client.post(f'{url}change/', {
+            'recipe': self.recipe.id,
+            'ingredient': self.ingredients[0].id,
+            'amount': 12,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.totals(self.users[0]), {'ing0': 12, 'ing1': 5})
+        self.client.post(f'{url}delete/', {'post': 'yes'})
+        self.assertEqual(self.totals(self.users[0]), {'ing1': 5})
+
+    def test_recipe_save_keeps_totals(self):
+        ShoppingCart.objects.create(user=self.users[0], recipe=self.recipe)
+        # Итоги пересчитываются только при изменении ингредиентов, а не
+        # при каждом сохранении рецепта.
+        IngredientRecipe.objects.filter(recipe=self.recipe).update(
+            amount=F('amount') + 1
+        )
+        self.recipe.save()
+        self.assertEqual(self.totals(self.users[0]), {'ing0': 10, 'ing1': 5})
+
+
+class UserRecipesTests(TestCase):
+    """Идемпотентное добавление и удаление рецептов пользователя."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='pass12345!'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Рецепт', image='recipes/x.png',
+            text='Текст', cooking_time=5
+        )
+
+    def check_repeats(self):
+        changes = []
+
+        def receiver(action, recipe_ids, **kwargs):
+            changes.append((action, recipe_ids))
+
+        user_recipes_changed.connect(receiver, sender=FavoriteRecipe)
+        self.addCleanup(
+            user_recipes_changed.disconnect, receiver, sender=FavoriteRecipe
+        )
+        ids = [self.recipe.id, self.recipe.id]
+        for _ in range(2):
+            FavoriteRecipe.objects.add(self.user, ids)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        for _ in range(2):
+            FavoriteRecipe.objects.remove(self.user, ids)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(
+            changes, [('add', [self.recipe.id]), ('remove', [self.recipe.id])]
+        )
+
+    def test_repeats_counted_once(self):
+        self.check_repeats()
+
+    def test_repeats_counted_once_without_returning(self):
+        with mock.patch('users.models.returning_supported',
+                        return_value=False):
+            self.check_repeats()
+
+
+class RecipeCountersTests(TestCase):
+    """Сохранение устаревшего рецепта не затирает счётчики."""
+
+    def test_stale_save(self):
+        user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='pass12345!'
+        )
+        recipe = Recipe.objects.create(
+            author=user, name='Рецепт', image='recipes/x.png',
+            text='Текст', cooking_time=5
+        )
+        stale = Recipe.objects.get(pk=recipe.pk)
+        FavoriteRecipe.objects.create(user=user, recipe=recipe)
+        tag = Tag.objects.create(name='Тэг', color='#000000', slug='tag')
+        recipe.tags.add(tag)
+        stale.name = 'Новое название'
+        stale.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.tags_mask, 1 << tag.bit)
+
+
+class ContentAddressedStorageTests(TestCase):
+    """Повторно не записываются только файлы с именем-хэшем."""
+
+    def setUp(self):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        self.storage = ContentAddressedStorage(location=location.name)
+
+    def read(self, name):
+        with self.storage.open(name) as stored:
+            return stored.read()
+
+    def test_same_hash_name_is_reused(self):
+        data = b'image'
+        name = f'recipes/{hashlib.sha256(data).hexdigest()}.png'
+        first = self.storage.save(name, ContentFile(data))
+        second = self.storage.save(name, ContentFile(data))
+        self.assertEqual(first, name)
+        self.assertEqual(second, name)
+        self.assertEqual(len(self.storage.listdir('recipes')[1]), 1)
+
+    def test_same_plain_name_is_not_reused(self):
+        first = self.storage.save('recipes/photo.jpg', ContentFile(b'one'))
+        second = self.storage.save('recipes/photo.jpg', ContentFile(b'two'))
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.read(first), b'one')
+        self.assertEqual(self.read(second), b'two')
+
+    def test_hash_name_with_other_content(self):
+        name = f'recipes/{hashlib.sha256(b"one").hexdigest()}.png'
+        first = self.storage.save(name, ContentFile(b'one'))
+        second = self.storage.save(name, ContentFile(b'two'))
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.read(second), b'two')
+
+
+class ImageVariantsTests(TestCase):
+    """Очередь уменьшенных копий картинок в базе."""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = Recipe._meta.get_field('image').storage
+        self.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов', password='pass12345!'
+        )
+
+    def save_image(self, color):
+        buffer = io.BytesIO()
+        Image.new('RGB', (800, 600), color).save(buffer, 'PNG')
+        data = buffer.getvalue()
+        return self.storage.save(
+            f'recipes/{hashlib.sha256(data).hexdigest()}.png',
+            ContentFile(data),
+        )
+
+    def create_recipe(self, image):
+        return Recipe.objects.create(
+            author=self.author, name='Рецепт', image=image, text='Текст',
+            cooking_time=5
+        )
+
+    def variants(self, recipe):
+        recipe = Recipe.objects.only(
+            'id', 'name', 'image', 'variants_image', 'cooking_time'
+        ).get(pk=recipe.pk)
+        with mock.patch.object(type(self.storage), 'exists') as exists:
+            data = ShortRecipeSerializer(recipe).data
+        exists.assert_not_called()
+        return data['image_variants']
+
+    def test_queue(self):
+        image = self.save_image((255, 0, 0))
+        recipe = self.create_recipe(image)
+        self.assertEqual(self.variants(recipe), {})
+        self.assertEqual(list(pending_images()), [image])
+
+        self.assertEqual(process_pending(self.storage), ([image], []))
+        for variant in variant_names(image).values():
+            self.assertTrue(self.storage.exists(variant))
+        self.assertEqual(set(self.variants(recipe)), {'320', '640'})
+        self.assertEqual(list(pending_images()), [])
+
+        # Та же картинка у нового рецепта: копии уже есть.
+        other = self.create_recipe(image)
+        self.assertEqual(process_pending(self.storage), ([image], []))
+        self.assertEqual(set(self.variants(other)), {'320', '640'})
+
+    def test_new_image_is_pending(self):
+        recipe = self.create_recipe(self.save_image((255, 0, 0)))
+        process_pending(self.storage)
+        recipe.image = self.save_image((0, 0, 255))
+        recipe.save()
+        self.assertEqual(self.variants(recipe), {})
+        self.assertEqual(list(pending_images()), [recipe.image.name])
+
+    def test_broken_image_stays_pending(self):
+        image = self.storage.save('recipes/broken.png', ContentFile(b'x'))
+        self.create_recipe(image)
+        with self.assertLogs('recipes.images', 'ERROR'):
+            self.assertEqual(process_pending(self.storage), ([], [image]))
+        self.assertEqual(list(pending_images()), [image])
+        self.assertEqual(process_pending(self.storage, skip=[image]),
+                         ([], []))
+
+
+class TagBitTests(TestCase):
+    """Биты тэгов в маске рецептов."""
+
+    def create_tag(self, number):
+        return Tag.objects.create(
+            name=f'Тэг {number}', color=f'#00000{number}', slug=f'tag{number}'
+        )
+
+    def test_free_bits(self):
+        tags = [self.create_tag(number) for number in range(3)]
+        self.assertEqual(sorted(tag.bit for tag in tags), [0, 1, 2])
+        tags[1].delete()
+        self.assertEqual(self.create_tag(3).bit, 1)
+
+    def test_failed_save_releases_bit(self):
+        self.create_tag(0)
+        tag = Tag(name='Тэг 0', color='#000001', slug='other')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            tag.save()
+        self.assertIsNone(tag.bit)
+
+
+class IngredientIndexTests(TestCase):
+    """Поиск ингредиентов для автодополнения."""
+
+    index = IngredientIndex(
+        (pk, name, 'г') for pk, name in enumerate(
+            ('Соль', 'сахар', 'морская соль', 'соус соевый', 'ёжевика'),
+            start=1,
+        )
+    )
+
+    def search(self, query):
+        return [item['name'] for item in self.index.search(query)]
+
+    def test_prefix_before_substring(self):
+        self.assertEqual(self.search('со'),
+                         ['Соль', 'соус соевый', 'морская соль'])
+        self.assertEqual(self.search(' СОЛЬ'), ['Соль', 'морская соль'])
+
+    def test_substring_by_trigrams(self):
+        self.assertEqual(self.search('ская'), ['морская соль'])
+        self.assertEqual(self.search('оев'), ['соус соевый'])
+        self.assertEqual(self.search('жев'), ['ёжевика'])
+
+    def test_typos(self):
+        self.assertEqual(self.search('сохар'), ['сахар'])
+        self.assertEqual(self.search('марская'), ['морская соль'])
+        self.assertEqual(self.search('сх'), [])
+        self.assertEqual(self.search('перец'), [])
+
+    def test_yo(self):
+        self.assertEqual(self.search('Еж'), ['ёжевика'])
+
+    def test_empty_query(self):
+        self.assertEqual(
+            self.search(''),
+            ['ёжевика', 'морская соль', 'сахар', 'Соль', 'соус соевый'],
+        )
+
+    def test_rebuilt_on_version_change(self):
+        cache.clear()
+        build_ingredient_index.cache_clear()
+        self.addCleanup(build_ingredient_index.cache_clear)
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        index = get_ingredient_index()
+        self.assertIs(get_ingredient_index(), index)
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='сахар', measurement_unit='г')
+        self.assertIsNot(get_ingredient_index(), index)
+        self.assertEqual(
+            [item['name'] for item in get_ingredient_index().search('са')],
+            ['сахар'],
+        )
+
+
+class ImportIngredientsTests(TestCase):
+    """Загрузка ингредиентов из файла."""
+
+    def import_file(self, suffix, content):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = f'{directory.name}/ingredients{suffix}'
+        with open(path, 'w', encoding='utf-8') as ingredients_file:
+            ingredients_file.write(content)
+        stderr = io.StringIO()
+        call_command('import_ingredients', path, stdout=io.StringIO(),
+                     stderr=stderr)
+        return stderr.getvalue()
+
+    def assert_imported(self):
+        self.assertEqual(
+            sorted(Ingredient.objects.values_list(
+                'name', 'measurement_unit'
+            )),
+            [('сахар', 'г'), ('соль', 'г')],
+        )
+
+    def test_csv_malformed_rows_skipped(self):
+        stderr = self.import_file(
+            '.csv', 'соль,г\n\nперец\n,\nсахар,г\nсоль,г\n'
+        )
+        self.assert_imported()
+        self.assertIn("Пропущена запись 2: {'name': 'перец'}", stderr)
+        self.assertIn('Пропущено записей: 1', stderr)
+
+    def test_json_malformed_rows_skipped(self):
+        stderr = self.import_file('.json', json.dumps([
+            {'name': 'соль', 'measurement_unit': 'г'},
+            {'name': 'перец'},
+            ['мука', 'г'],
+            {'name': 'сахар', 'measurement_unit': 'г'},
+        ]))
+        self.assert_imported()
+        self.assertIn('Пропущено записей: 2', stderr)
@@ -5,7 +5,8 @@ from .models import Follow, User
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('first_name', 'last_name', 'username', 'email')
+    list_display = ('first_name', 'last_name', 'username', 'email',
+                    'recipes_count', 'followers_count')
     list_filter = ('email', 'first_name', 'last_name')
 
 
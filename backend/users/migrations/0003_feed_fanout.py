@@ -0,0 +1,27 @@
+# Generated by Django 3.2 on 2026-10-18 04:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_feed_fanout(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    User.objects.filter(
+        followers_count__gt=settings.FEED_FANOUT_LIMIT
+    ).update(feed_fanout=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='feed_fanout',
+            field=models.BooleanField(default=True, editable=False, verbose_name='Рецепты раздаются в ленты'),
+        ),
+        migrations.RunPython(fill_feed_fanout, migrations.RunPython.noop),
+    ]
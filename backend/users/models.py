@@ -1,8 +1,42 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import connections, models, transaction
+from django.dispatch import Signal
 
+# Подписки пользователя изменены массово, без сигналов по каждой строке.
+# Аргументы: user_id, action ('add' или 'remove') и author_ids — id
+# авторов, подписка на которых действительно добавлена или убрана.
+follows_changed = Signal()
 
-class User(AbstractUser):
+
+class CountersMixin:
+    """Модель с денормализованными полями counter_fields: счётчиками и
+    другими значениями, которые поддерживаются отдельными обновлениями.
+
+    Такие поля меняются только через update(): обычное сохранение
+    существующей строки их не пишет, иначе устаревший экземпляр затёр
+    бы значения, изменённые после его загрузки.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('force_insert'):
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                deferred = self.get_deferred_fields()
+                update_fields = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key
+                    and field.attname not in deferred
+                ]
+            kwargs['update_fields'] = [
+                name for name in update_fields
+                if name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(CountersMixin, AbstractUser):
     """Модель пользователя."""
 
     email = models.EmailField(
@@ -31,6 +65,23 @@ class User(AbstractUser):
         default=False,
         verbose_name="Подписка"
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков'
+    )
+    feed_fanout = models.BooleanField(
+        default=True,
+        editable=False,
+        verbose_name='Рецепты раздаются в ленты'
+    )
+
+    counter_fields = ('recipes_count', 'followers_count', 'feed_fanout')
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username", "first_name", "last_name", "password"]
@@ -48,6 +99,125 @@ class User(AbstractUser):
         return f'{self.first_name} {self.last_name}'
 
 
+def returning_supported(connection):
+    """Есть ли INSERT и DELETE ... RETURNING: PostgreSQL и SQLite 3.35+."""
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return connection.vendor == 'postgresql'
+
+
+class UserLinkQuerySet(models.QuerySet):
+    """Связи пользователя с объектами поля link_field.
+
+    Вставка и удаление возвращают id объектов действительно изменённых
+    связей, которые сообщает сама база: параллельные одинаковые запросы
+    не посчитают одну связь дважды. Без RETURNING связи пользователя
+    меняются под блокировкой его строки. Вызывать внутри транзакции.
+    """
+
+    link_field = None
+
+    def columns(self, connection):
+        meta = self.model._meta
+        return (
+            connection.ops.quote_name(meta.db_table),
+            connection.ops.quote_name(meta.get_field('user').column),
+            connection.ops.quote_name(
+                meta.get_field(self.link_field).column
+            ),
+        )
+
+    def lock_user(self, user_id):
+        list(User.objects.using(self.db).select_for_update().filter(
+            pk=user_id
+        ).values_list('pk', flat=True))
+
+    def insert_links(self, user_id, ids):
+        """Добавляет связи, существующие пропускаются."""
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return []
+        connection = connections[self.db]
+        if not returning_supported(connection):
+            self.lock_user(user_id)
+            existing = set(self.filter(
+                user_id=user_id, **{f'{self.link_field}_id__in': ids}
+            ).values_list(f'{self.link_field}_id', flat=True))
+            added = [pk for pk in ids if pk not in existing]
+            self.bulk_create(
+                self.model(user_id=user_id, **{f'{self.link_field}_id': pk})
+                for pk in added
+            )
+            return added
+        table, user_column, link_column = self.columns(connection)
+        values = ', '.join(['(%s, %s)'] * len(ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({user_column}, {link_column}) '
+                f'VALUES {values} '
+                f'ON CONFLICT ({user_column}, {link_column}) DO NOTHING '
+                f'RETURNING {link_column}',
+                [value for pk in ids for value in (user_id, pk)],
+            )
+            return [pk for pk, in cursor.fetchall()]
+
+    def delete_links(self, user_id, ids):
+        """Удаляет связи, отсутствующие пропускаются."""
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return []
+        connection = connections[self.db]
+        if not returning_supported(connection):
+            self.lock_user(user_id)
+            removed = list(self.filter(
+                user_id=user_id, **{f'{self.link_field}_id__in': ids}
+            ).values_list(f'{self.link_field}_id', flat=True))
+            self.filter(
+                user_id=user_id, **{f'{self.link_field}_id__in': removed}
+            )._raw_delete(self.db)
+            return removed
+        table, user_column, link_column = self.columns(connection)
+        placeholders = ', '.join(['%s'] * len(ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE {user_column} = %s '
+                f'AND {link_column} IN ({placeholders}) '
+                f'RETURNING {link_column}',
+                (user_id, *ids),
+            )
+            return [pk for pk, in cursor.fetchall()]
+
+
+class FollowQuerySet(UserLinkQuerySet):
+    """Запросы к подпискам."""
+
+    link_field = 'author'
+
+    def follow(self, user, author_ids):
+        """Подписывает на авторов одним INSERT, существующие подписки
+        пропускаются. Авторы должны существовать.
+        """
+        with transaction.atomic(using=self.db):
+            added = self.insert_links(user.id, author_ids)
+            if added:
+                follows_changed.send(
+                    self.model, user_id=user.id, action='add',
+                    author_ids=added
+                )
+
+    def unfollow(self, user, author_ids):
+        """Отписывает от авторов одним DELETE, отсутствующие подписки
+        пропускаются.
+        """
+        with transaction.atomic(using=self.db):
+            removed = self.delete_links(user.id, author_ids)
+            if removed:
+                follows_changed.send(
+                    self.model, user_id=user.id, action='remove',
+                    author_ids=removed
+                )
+
+
 class Follow(models.Model):
     """Подписка."""
 
@@ -64,6 +234,8 @@ class Follow(models.Model):
         verbose_name='Автор'
     )
 
+    objects = FollowQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = 'Подписки'
         constraints = [
@@ -1,9 +1,32 @@
+from collections import defaultdict
+
+from django.db import models
 from djoser.serializers import UserSerializer
 from rest_framework import serializers
 
 from .models import Follow, User
+from api.fields import ImageVariantsField
 from recipes.models import Recipe
 
+# Рецептов автора в подписках по умолчанию и самое большее.
+DEFAULT_RECIPES_LIMIT = 10
+MAX_RECIPES_LIMIT = 100
+
+
+def get_following_ids(request):
+    """Id авторов, на которых подписан пользователь запроса.
+
+    Выбираются одним запросом и запоминаются на объекте запроса,
+    чтобы не проверять подписку отдельно для каждого автора.
+    """
+    if not hasattr(request, '_following_ids'):
+        request._following_ids = set(
+            Follow.objects.filter(user=request.user).values_list(
+                'author_id', flat=True
+            )
+        )
+    return request._following_ids
+
 
 class CurrentUserSerializer(UserSerializer):
     is_subscribed = serializers.SerializerMethodField(read_only=True)
@@ -18,17 +41,74 @@ class CurrentUserSerializer(UserSerializer):
         request = self.context.get("request")
         if not request.user.is_authenticated:
             return False
-        return Follow.objects.filter(user=request.user,
-                                     author=obj).exists()
+        return obj.id in get_following_ids(request)
+
+
+# Поля рецепта, которые нужны ShortRecipeSerializer, для .only().
+SHORT_RECIPE_FIELDS = ('id', 'name', 'image', 'variants_image', 'cooking_time')
 
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+
+def get_recipes_limit(request):
+    """Значение параметра recipes_limit, не больше MAX_RECIPES_LIMIT.
+
+    Если параметр не задан, берётся DEFAULT_RECIPES_LIMIT: у плодовитого
+    автора без ограничения ответ вырастал бы до мегабайт.
+    """
+    try:
+        recipes_limit = int(request.query_params['recipes_limit'])
+    except (AttributeError, KeyError, ValueError):
+        return DEFAULT_RECIPES_LIMIT
+    return min(max(recipes_limit, 0), MAX_RECIPES_LIMIT)
+
+
+class AuthorRecipesListSerializer(serializers.ListSerializer):
+    """Список авторов, рецепты которых выбираются одним запросом."""
 
+    def to_representation(self, data):
+        if isinstance(data, models.Manager):
+            data = data.all()
+        data = list(data)
+        self.child.prefetch_recipes(data)
+        return super().to_representation(data)
 
-class SubscriptionsSerializer(CurrentUserSerializer):
+
+class AuthorRecipesMixin:
+    """Рецепты автора и их количество с учётом recipes_limit."""
+
+    def get_author(self, obj):
+        return obj
+
+    def prefetch_recipes(self, objs):
+        authors = [self.get_author(obj) for obj in objs]
+        recipes = Recipe.objects.latest_for_authors(
+            [author.id for author in authors],
+            get_recipes_limit(self.context.get('request')),
+        )
+        recipes_by_author = defaultdict(list)
+        for recipe in recipes:
+            recipes_by_author[recipe.author_id].append(recipe)
+        for author in authors:
+            author.latest_recipes = recipes_by_author[author.id]
+
+    def get_recipes(self, obj):
+        author = self.get_author(obj)
+        if not hasattr(author, 'latest_recipes'):
+            self.prefetch_recipes([obj])
+        return ShortRecipeSerializer(author.latest_recipes, many=True).data
+
+    def get_recipes_count(self, obj):
+        return self.get_author(obj).recipes_count
+
+
+class SubscriptionsSerializer(AuthorRecipesMixin, CurrentUserSerializer):
     recipes = serializers.SerializerMethodField(read_only=True)
     recipes_count = serializers.SerializerMethodField(read_only=True)
 
@@ -36,12 +116,4 @@ class SubscriptionsSerializer(CurrentUserSerializer):
         model = User
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipes_count')
-
-    def get_recipes(self, obj):
-        recipes = Recipe.objects.filter(author=obj)
-        serializer = ShortRecipeSerializer(recipes, many=True)
-        return serializer.data
-
-    def get_recipes_count(self, obj):
-        recipes = Recipe.objects.filter(author=obj)
-        return recipes.count()
+        list_serializer_class = AuthorRecipesListSerializer
@@ -0,0 +1,58 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .models import Follow, User, follows_changed
+from api.authentication import forget_tokens
+from recipes.cache import bump_version_on_commit
+from recipes.models import FeedEntry
+
+# Поля пользователя, которые выводятся в рецептах его авторства.
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    forget_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+def author_changed(instance, created, update_fields, **kwargs):
+    if created or (
+        update_fields and not AUTHOR_FIELDS & set(update_fields)
+    ):
+        return
+    bump_version_on_commit(f'user:{instance.pk}')
+
+
+# Ленты обновляются после счётчиков подписчиков: от них зависит, раздавать
+# ли рецепты автора в ленты.
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).update(
+            followers_count=F('followers_count') + 1
+        )
+        FeedEntry.objects.followed(instance.user_id, [instance.author_id])
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).update(
+        followers_count=F('followers_count') - 1
+    )
+    FeedEntry.objects.unfollowed(instance.user_id, [instance.author_id])
+
+
+@receiver(follows_changed, sender=Follow)
+def follows_bulk_changed(user_id, action, author_ids, **kwargs):
+    User.objects.filter(pk__in=author_ids).update(
+        followers_count=F('followers_count') + (1 if action == 'add' else -1)
+    )
+    if action == 'add':
+        FeedEntry.objects.followed(user_id, author_ids)
+    else:
+        FeedEntry.objects.unfollowed(user_id, author_ids)
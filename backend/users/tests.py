@@ -0,0 +1,85 @@
+from unittest import mock
+
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from .models import Follow, User
+
+
+class SubscribeTests(TestCase):
+    """Повторная подписка и отписка."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author = (
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name='Имя', last_name='Фамилия', password='pass12345!'
+            )
+            for name in ('user', 'author')
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_followers_count(self, count):
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, count)
+
+    def check_repeats(self):
+        url = f'/api/users/{self.author.id}/subscribe/'
+        for _ in range(2):
+            self.assertEqual(self.client.post(url).status_code, 201)
+        self.assert_followers_count(1)
+        for _ in range(2):
+            self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assert_followers_count(0)
+        self.assertFalse(Follow.objects.exists())
+
+    def test_repeats_counted_once(self):
+        self.check_repeats()
+
+    def test_repeats_counted_once_without_returning(self):
+        with mock.patch('users.models.returning_supported',
+                        return_value=False):
+            self.check_repeats()
+
+
+class CountersTests(TestCase):
+    """Сохранение устаревшего пользователя не затирает счётчики."""
+
+    def setUp(self):
+        self.user, self.author = (
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name='Имя', last_name='Фамилия', password='pass12345!'
+            )
+            for name in ('user', 'author')
+        )
+        # Экземпляр автора загружен до подписки.
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        Follow.objects.create(user=self.user, author=self.author)
+
+    def assert_followers_count(self, count):
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).followers_count, count
+        )
+
+    def test_set_password(self):
+        self.assert_followers_count(1)
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'pass12345!',
+            'new_password': 'new-pass12345!',
+        })
+        self.assertEqual(response.status_code, 204)
+        self.assert_followers_count(1)
+
+    def test_save(self):
+        self.author.first_name = 'Другое'
+        self.author.save()
+        self.assert_followers_count(1)
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).first_name, 'Другое'
+        )